@@ -0,0 +1,256 @@
+# bench.py
+# Нагрузочный прогон чат-сервера: N виртуальных пользователей, сообщения с заданной
+# частотой, на выходе JSON с пропускной способностью, задержками и ресурсами сервера.
+import asyncio
+import argparse
+import json
+import os
+import platform
+import shlex
+import socket
+import subprocess
+import sys
+import time
+
+from Headless import HeadlessClient
+from Protocol import make_client_context
+
+BENCH_PREFIX = "bench:"
+# Бенчмарк меряет сам сервер, поэтому ограничения частоты ему выключаем
+BENCH_SERVER_ARGS = "--no-history --backlog 1024 --rate-limit 0 --room-rate-limit 0"
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def process_stats(pid):
+    """RSS (КБ) и число потоков процесса: /proc в Linux или psutil, если установлен"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            fields = dict(line.split(":", 1) for line in status if ":" in line)
+        return int(fields["VmRSS"].split()[0]), int(fields["Threads"])
+    except (OSError, KeyError, ValueError):
+        pass
+    try:
+        import psutil
+        process = psutil.Process(pid)
+        return process.memory_info().rss // 1024, process.num_threads()
+    except Exception:
+        return None, None
+
+
+def wait_for_port(host, port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+class Benchmark:
+    """Один прогон: подключение пользователей, рассылка, сбор метрик"""
+
+    def __init__(self, args):
+        self.args = args
+        self.clients = []
+        self.latencies = []
+        self.delivered = 0
+        self.sent = 0
+        self.failed_connections = 0
+        self.peak_rss_kb = None
+        self.peak_threads = None
+        self.server_pid = args.server_pid
+        self.tls = make_client_context(args.tls_ca) if args.tls or args.tls_ca else None
+
+    def on_message(self, client, message_data):
+        content = message_data.get('message', '')
+        if message_data.get('type') == 'message' and content.startswith(BENCH_PREFIX):
+            sent_at = float(content.split(":", 2)[1])
+            self.latencies.append(time.perf_counter() - sent_at)
+            self.delivered += 1
+
+    async def connect_users(self):
+        """Подключает пользователей пачками, чтобы не переполнить очередь accept"""
+        semaphore = asyncio.Semaphore(self.args.connect_concurrency)
+
+        async def connect(index):
+            client = HeadlessClient(f"bench_{index}", self.args.host, self.args.port, self.on_message,
+                                    encoding=self.args.encoding, compression=self.args.compression,
+                                    tls=self.tls)
+            async with semaphore:
+                try:
+                    await client.connect()
+                    self.clients.append(client)
+                except (OSError, asyncio.TimeoutError, ConnectionError):
+                    self.failed_connections += 1
+
+        await asyncio.gather(*(connect(index) for index in range(self.args.users)))
+
+    async def sender(self, client, interval, deadline):
+        """Шлёт сообщения по расписанию, не накапливая дрейф"""
+        next_send = time.perf_counter()
+        padding = "x" * self.args.message_size
+        while next_send < deadline and client.connected:
+            await client.send_message(f"{BENCH_PREFIX}{time.perf_counter()!r}:{padding}")
+            self.sent += 1
+            next_send += interval
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def sample_server(self):
+        while True:
+            rss_kb, threads = process_stats(self.server_pid)
+            if rss_kb is not None:
+                self.peak_rss_kb = max(self.peak_rss_kb or 0, rss_kb)
+                self.peak_threads = max(self.peak_threads or 0, threads)
+            await asyncio.sleep(0.5)
+
+    async def run(self):
+        sampler = None
+        if self.server_pid:
+            sampler = asyncio.get_running_loop().create_task(self.sample_server())
+
+        connect_started = time.perf_counter()
+        await self.connect_users()
+        connect_time = time.perf_counter() - connect_started
+        idle_rss_kb, idle_threads = process_stats(self.server_pid) if self.server_pid else (None, None)
+
+        # Даём серверу разослать уведомления о входе, чтобы они не попали в замер
+        await asyncio.sleep(1)
+
+        senders = self.clients[:self.args.senders or len(self.clients)]
+        started = time.perf_counter()
+        deadline = started + self.args.duration
+        if senders:
+            interval = len(senders) / self.args.rate
+            await asyncio.gather(*(self.sender(client, interval, deadline) for client in senders))
+        send_time = time.perf_counter() - started
+
+        expected = self.sent * len(self.clients)
+        drain_deadline = time.perf_counter() + self.args.drain
+        while self.delivered < expected and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        if sampler is not None:
+            sampler.cancel()
+        await asyncio.gather(*(client.close() for client in self.clients))
+        received_bytes = sum(client.bytes_received for client in self.clients)
+
+        latencies = sorted(self.latencies)
+        to_ms = lambda value: None if value is None else round(value * 1000, 3)
+        return {
+            "config": {
+                "users": self.args.users,
+                "senders": len(senders),
+                "rate": self.args.rate,
+                "duration": self.args.duration,
+                "message_size": self.args.message_size,
+                "encoding": self.args.encoding,
+                "compression": self.args.compression,
+                "tls": self.tls is not None,
+                "mode": self.args.mode if self.args.spawn_server else None,
+            },
+            "connected": len(self.clients),
+            "failed_connections": self.failed_connections,
+            "connect_time_s": round(connect_time, 3),
+            "sent": self.sent,
+            "send_rate": round(self.sent / send_time, 1) if send_time else None,
+            "expected_deliveries": expected,
+            "delivered": self.delivered,
+            "delivery_ratio": round(self.delivered / expected, 4) if expected else None,
+            "fanout_throughput": round(self.delivered / elapsed, 1) if elapsed else None,
+            "received_bytes": received_bytes,
+            "bytes_per_delivery": round(received_bytes / self.delivered, 1) if self.delivered else None,
+            "latency_ms": {
+                "p50": to_ms(percentile(latencies, 0.50)),
+                "p90": to_ms(percentile(latencies, 0.90)),
+                "p99": to_ms(percentile(latencies, 0.99)),
+                "max": to_ms(latencies[-1] if latencies else None),
+            },
+            "server": {
+                "pid": self.server_pid,
+                "idle_rss_kb": idle_rss_kb,
+                "idle_threads": idle_threads,
+                "peak_rss_kb": self.peak_rss_kb,
+                "peak_threads": self.peak_threads,
+            },
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        }
+
+
+def start_server(args):
+    """Запускает Server.py в отдельном процессе на время прогона"""
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Server.py")
+    command = [sys.executable, server_path, "--host", args.host, "--port", str(args.port),
+               "--mode", args.mode] + shlex.split(args.server_args)
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_for_port(args.host, args.port):
+        process.kill()
+        raise RuntimeError("Сервер не запустился")
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест чат-сервера')
+    parser.add_argument('--host', default='127.0.0.1', help='Хост сервера (по умолчанию: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=5555, help='Порт сервера (по умолчанию: 5555)')
+    parser.add_argument('--users', type=int, default=100, help='Число пользователей (по умолчанию: 100)')
+    parser.add_argument('--senders', type=int, default=10,
+                        help='Сколько пользователей отправляют сообщения, 0 - все (по умолчанию: 10)')
+    parser.add_argument('--rate', type=float, default=50,
+                        help='Суммарная частота отправки, сообщений/с (по умолчанию: 50)')
+    parser.add_argument('--duration', type=float, default=10, help='Длительность отправки, с (по умолчанию: 10)')
+    parser.add_argument('--drain', type=float, default=10,
+                        help='Сколько ждать доставки после отправки, с (по умолчанию: 10)')
+    parser.add_argument('--message-size', type=int, default=64, help='Размер полезной нагрузки, байт')
+    parser.add_argument('--encoding', choices=['json', 'compact'], default='json',
+                        help='Кодировка кадров, которую запрашивают боты (по умолчанию: json)')
+    parser.add_argument('--compression', choices=['deflate'], default=None,
+                        help='Запросить сжатие крупных кадров (по умолчанию: без сжатия)')
+    parser.add_argument('--tls', action='store_true', help='Подключать ботов по TLS')
+    parser.add_argument('--tls-ca', default=None, help='Сертификат, которому доверяют боты (включает TLS)')
+    parser.add_argument('--connect-concurrency', type=int, default=100,
+                        help='Сколько подключений устанавливать одновременно')
+    parser.add_argument('--spawn-server', action='store_true', help='Запустить Server.py на время теста')
+    parser.add_argument('--mode', choices=['threads', 'asyncio'], default='threads',
+                        help='Режим запускаемого сервера (с --spawn-server)')
+    parser.add_argument('--server-args', default=BENCH_SERVER_ARGS,
+                        help=f'Дополнительные аргументы запускаемого сервера (по умолчанию: {BENCH_SERVER_ARGS})')
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help='PID уже запущенного сервера для замера памяти и потоков')
+    parser.add_argument('--output', default=None, help='Записать результат JSON в файл')
+
+    args = parser.parse_args()
+
+    process = None
+    if args.spawn_server:
+        process = start_server(args)
+        args.server_pid = process.pid
+
+    try:
+        result = asyncio.run(Benchmark(args).run())
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    report = json.dumps(result, indent=2, ensure_ascii=False)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+# bus.py
+# Шина pub/sub между несколькими процессами (или машинами) чат-сервера.
+# Через неё воркеры пересылают друг другу сообщения комнат и изменения
+# списка онлайн, а ники раздаются централизованно, чтобы не было дублей.
+#
+# LocalBroker - брокер внутри одного процесса (для тестов и отладки),
+# BusBroker - тот же брокер за Unix-сокетом или TCP, SocketBus - его клиент.
+import argparse
+import itertools
+import json
+import logging
+import os
+import socket
+import threading
+
+from Protocol import FrameReader, ProtocolError, encode_frame, encode_message, decode_message
+
+# Связь с брокером пропала: переподключаемся с растущей паузой, а пока его нет,
+# воркер доставляет сообщения только своим клиентам и раздаёт ники сам
+RECONNECT_BASE = 0.5
+RECONNECT_MAX = 10
+
+log = logging.getLogger("chat.bus")
+
+
+class NicknameTable:
+    """Глобальная таблица ников: кто из воркеров каким ником владеет"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.owners = {}
+        self.suffix_counters = {}
+
+    def claim(self, nickname, owner, takeover=False):
+        """Выдаёт свободный ник (с суффиксом _N, если занят) и закрепляет его за владельцем.
+
+        takeover - клиент вернулся с проверенной сессией: ник переходит к новому владельцу,
+        даже если занят. Возвращает (ник, прежний владелец или None), чтобы прежнему
+        владельцу можно было сказать закрыть старое подключение.
+        """
+        with self.lock:
+            previous = self.owners.get(nickname)
+            if takeover and previous is not None:
+                self.owners[nickname] = owner
+                return nickname, (previous if previous != owner else None)
+            if previous is not None:
+                base = nickname
+                counter = self.suffix_counters.get(base, 1)
+                nickname = f"{base}_{counter}"
+                while nickname in self.owners:
+                    counter += 1
+                    nickname = f"{base}_{counter}"
+                self.suffix_counters[base] = counter + 1
+            self.owners[nickname] = owner
+            return nickname, None
+
+    def restore(self, nicknames, owner):
+        """Возвращает владельцу ники после переподключения к брокеру (занятые другими не трогает)"""
+        with self.lock:
+            for nickname in nicknames:
+                self.owners.setdefault(nickname, owner)
+
+    def release(self, nickname, owner):
+        with self.lock:
+            if self.owners.get(nickname) == owner:
+                del self.owners[nickname]
+            if not self.owners:
+                self.suffix_counters.clear()
+
+    def release_owner(self, owner):
+        """Освобождает все ники отвалившегося воркера и возвращает их"""
+        with self.lock:
+            released = [nickname for nickname, current in self.owners.items() if current == owner]
+            for nickname in released:
+                del self.owners[nickname]
+            return released
+
+
+class LocalBroker:
+    """Брокер в памяти процесса: воркеры - это несколько ChatServer в одном процессе"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nicknames = NicknameTable()
+        self.members = {}
+        self.ids = itertools.count(1)
+
+    def attach(self):
+        bus = LocalBus(self, next(self.ids))
+        with self.lock:
+            self.members[bus.worker_id] = bus
+        return bus
+
+    def detach(self, bus):
+        with self.lock:
+            self.members.pop(bus.worker_id, None)
+        for nickname in self.nicknames.release_owner(bus.worker_id):
+            self.publish(bus.worker_id, "presence", {"event": "leave", "nickname": nickname})
+
+    def publish(self, origin, topic, payload):
+        with self.lock:
+            members = [bus for worker_id, bus in self.members.items() if worker_id != origin]
+        for bus in members:
+            bus.deliver(topic, payload)
+
+    def claim(self, nickname, worker_id, takeover):
+        nickname, previous = self.nicknames.claim(nickname, worker_id, takeover)
+        with self.lock:
+            displaced = self.members.get(previous)
+        if displaced is not None:
+            displaced.deliver("takeover", {"nickname": nickname})
+        return nickname
+
+
+class LocalBus:
+    """Клиент LocalBroker с тем же интерфейсом, что и SocketBus"""
+
+    def __init__(self, broker, worker_id):
+        self.broker = broker
+        self.worker_id = worker_id
+        self.handler = None
+
+    def subscribe(self, handler):
+        """handler(topic, payload) вызывается для сообщений других воркеров"""
+        self.handler = handler
+
+    def deliver(self, topic, payload):
+        if self.handler is not None:
+            self.handler(topic, payload)
+
+    def publish(self, topic, payload):
+        self.broker.publish(self.worker_id, topic, payload)
+
+    def claim_nickname(self, nickname, takeover=False):
+        return self.broker.claim(nickname, self.worker_id, takeover)
+
+    def release_nickname(self, nickname):
+        self.broker.nicknames.release(nickname, self.worker_id)
+
+    def close(self):
+        self.broker.detach(self)
+
+
+def parse_address(address):
+    """'unix:/path/to.sock' или 'host:port' -> (семейство сокета, адрес)"""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+class BusBroker:
+    """Брокер шины за сокетом: поток на каждого воркера, воркеров единицы"""
+
+    def __init__(self, address):
+        self.address = address
+        self.nicknames = NicknameTable()
+        self.lock = threading.Lock()
+        self.workers = {}
+        self.ids = itertools.count(1)
+        self.running = False
+        self.server_socket = None
+
+    def start(self):
+        family, bind_address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(bind_address):
+            os.unlink(bind_address)
+        self.server_socket = socket.socket(family, socket.SOCK_STREAM)
+        if family != socket.AF_UNIX:
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind(bind_address)
+        self.server_socket.listen(64)
+        self.running = True
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                sock, _ = self.server_socket.accept()
+            except OSError:
+                break
+            if not self.running:
+                sock.close()
+                break
+            worker_id = next(self.ids)
+            with self.lock:
+                self.workers[worker_id] = (sock, threading.Lock())
+            threading.Thread(target=self.serve_worker, args=(worker_id, sock), daemon=True).start()
+
+    def serve_worker(self, worker_id, sock):
+        reader = FrameReader(sock)
+        try:
+            while True:
+                frame = reader.read_frame()
+                if frame is None:
+                    break
+                request = decode_message(frame)
+                op = request.get("op")
+                if op == "publish":
+                    self.publish(worker_id, frame)
+                elif op == "claim":
+                    nickname, previous = self.nicknames.claim(request["nickname"], worker_id,
+                                                              bool(request.get("takeover")))
+                    if previous is not None:
+                        # Старое подключение этого ника закрывает воркер, у которого оно висит
+                        self.send(previous, encode_message({"op": "publish", "topic": "takeover",
+                                                            "payload": {"nickname": nickname}}))
+                    self.send(worker_id, encode_message({"op": "claimed", "id": request["id"],
+                                                         "nickname": nickname}))
+                elif op == "release":
+                    self.nicknames.release(request["nickname"], worker_id)
+                elif op == "restore":
+                    self.nicknames.restore(request["nicknames"], worker_id)
+        except (OSError, ProtocolError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                self.workers.pop(worker_id, None)
+            sock.close()
+            # Пользователи упавшего воркера для остальных уходят из онлайна
+            for nickname in self.nicknames.release_owner(worker_id):
+                self.publish(worker_id, json.dumps({
+                    "op": "publish", "topic": "presence",
+                    "payload": {"event": "leave", "nickname": nickname}
+                }).encode('utf-8'))
+
+    def publish(self, origin, payload):
+        """Пересылает кадр publish всем воркерам, кроме отправителя, без перекодирования"""
+        data = encode_frame(payload)
+        with self.lock:
+            targets = [worker_id for worker_id in self.workers if worker_id != origin]
+        for worker_id in targets:
+            self.send(worker_id, data)
+
+    def send(self, worker_id, data):
+        with self.lock:
+            entry = self.workers.get(worker_id)
+        if entry is None:
+            return
+        sock, send_lock = entry
+        try:
+            with send_lock:
+                sock.sendall(data)
+        except OSError:
+            pass
+
+    def stop(self):
+        self.running = False
+        if self.server_socket is not None:
+            try:
+                # shutdown будит accept; до него новые подключения ещё принимались бы
+                self.server_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.server_socket.close()
+        family, bind_address = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(bind_address):
+            os.unlink(bind_address)
+        # Воркеры отключаются последними, когда переподключиться сюда уже нельзя
+        with self.lock:
+            sockets = [sock for sock, _ in self.workers.values()]
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class SocketBus:
+    """Клиент BusBroker: публикация, подписка и раздача ников через брокер.
+
+    Если брокер пропал, ни publish, ни release_nickname не бросают исключений:
+    сообщения просто не уходят на другие воркеры, claim_nickname оставляет ник
+    как есть, а поток чтения переподключается. После переподключения брокер
+    получает ники этого воркера, а подписчик - событие "reconnected".
+    """
+
+    def __init__(self, address, timeout=5):
+        self.family, self.connect_address = parse_address(address)
+        self.timeout = timeout
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        self.ids = itertools.count(1)
+        self.handler = None
+        # Ники, выданные этому воркеру, - их брокер узнаёт заново после переподключения
+        self.claimed = set()
+        self.claimed_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.sock = self.open()
+        self.connected = True
+        self.reader_thread = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader_thread.start()
+
+    def open(self):
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.connect_address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def subscribe(self, handler):
+        """handler(topic, payload) вызывается в потоке чтения шины"""
+        self.handler = handler
+
+    def send(self, request):
+        """Отправляет запрос брокеру; False - брокера сейчас нет, запрос не ушёл"""
+        if not self.connected:
+            return False
+        data = encode_message(request)
+        sock = self.sock
+        try:
+            with self.send_lock:
+                sock.sendall(data)
+        except OSError:
+            self.drop(sock)
+            return False
+        return True
+
+    def drop(self, sock):
+        """Отмечает обрыв связи: будит поток чтения и тех, кто ждёт ответа брокера"""
+        if sock is not self.sock:
+            return
+        self.connected = False
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        for request_id in list(self.pending):
+            waiter = self.pending.pop(request_id, None)
+            if waiter is not None:
+                waiter[0].set()
+
+    def read_loop(self):
+        """Читает брокер, а после обрыва переподключается с растущей паузой"""
+        failures = 0
+        while not self.stopping.is_set():
+            if not self.connected:
+                try:
+                    sock = self.open()
+                except OSError:
+                    failures += 1
+                    self.stopping.wait(min(RECONNECT_MAX, RECONNECT_BASE * 2 ** (failures - 1)))
+                    continue
+                failures = 0
+                self.sock = sock
+                self.connected = True
+                log.info("🚌 Связь с брокером шины восстановлена")
+                self.restore()
+            self.read_frames(self.sock)
+            if not self.stopping.is_set():
+                self.drop(self.sock)
+                log.warning("🚌 Связь с брокером шины потеряна: переподключаемся, "
+                            "а пока сообщения доставляются только на этом воркере")
+
+    def read_frames(self, sock):
+        reader = FrameReader(sock)
+        try:
+            while True:
+                frame = reader.read_frame()
+                if frame is None:
+                    break
+                message = decode_message(frame)
+                if message.get("op") == "claimed":
+                    waiter = self.pending.pop(message["id"], None)
+                    if waiter is not None:
+                        waiter[1] = message["nickname"]
+                        waiter[0].set()
+                elif self.handler is not None:
+                    self.handler(message.get("topic"), message.get("payload"))
+        except (OSError, ProtocolError, ValueError):
+            pass
+
+    def restore(self):
+        """Возвращает брокеру ники этого воркера и сообщает подписчику о переподключении"""
+        with self.claimed_lock:
+            nicknames = sorted(self.claimed)
+        self.send({"op": "restore", "nicknames": nicknames})
+        if self.handler is not None:
+            self.handler("reconnected", {})
+
+    def publish(self, topic, payload):
+        self.send({"op": "publish", "topic": topic, "payload": payload})
+
+    def claim_nickname(self, nickname, takeover=False):
+        """Синхронно запрашивает у брокера уникальный ник; takeover - забрать ник у старого
+        подключения на другом воркере (клиент вернулся с проверенной сессией).
+        Без брокера ник остаётся как есть: уникальность тогда только в этом воркере."""
+        request_id = next(self.ids)
+        waiter = [threading.Event(), None]
+        self.pending[request_id] = waiter
+        request = {"op": "claim", "id": request_id, "nickname": nickname}
+        if takeover:
+            request["takeover"] = True
+        if self.send(request) and waiter[0].wait(self.timeout):
+            nickname = waiter[1] or nickname
+        else:
+            self.pending.pop(request_id, None)
+            log.warning("🚌 Брокер шины не ответил, ник %s выдан без проверки на других воркерах", nickname)
+        with self.claimed_lock:
+            self.claimed.add(nickname)
+        return nickname
+
+    def release_nickname(self, nickname):
+        with self.claimed_lock:
+            self.claimed.discard(nickname)
+        self.send({"op": "release", "nickname": nickname})
+
+    def close(self):
+        self.stopping.set()
+        self.connected = False
+        try:
+            # shutdown будит поток чтения, заблокированный в recv
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Брокер шины для нескольких чат-серверов')
+    parser.add_argument('--listen', default='127.0.0.1:5560',
+                        help="Адрес брокера: host:port или unix:/путь (по умолчанию: 127.0.0.1:5560)")
+    args = parser.parse_args()
+
+    broker = BusBroker(args.listen)
+    broker.start()
+    print(f"🚌 Брокер шины слушает {args.listen}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,592 @@
+# clientcore.py
+# Сетевая часть клиента чата без GUI: подключение и рукопожатие, сессия,
+# переподключение, пульс, команды и разбор входящих сообщений в строки чата.
+# Окно Tk (ClientGui.py) и консольный режим (Client.py --headless) только
+# показывают эти строки; tkinter здесь не импортируется.
+import json
+import os
+import socket
+import threading
+import queue
+import random
+import time
+from collections import deque
+
+from Protocol import (NICK_REQUEST, DEFAULT_ROOM, COMPRESSION, JSON_CODEC, FrameReader,
+                      encode_hello, get_codec)
+
+# Сколько входящих сообщений разбирать за один проход главного цикла
+MAX_BATCH = 500
+# Переподключение: экспоненциальная задержка со случайным разбросом (full jitter),
+# чтобы после перезапуска сервера клиенты не ломились все в одну секунду
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+# Если от сервера ничего нет дольше интервала пульса - шлём ping, а через два интервала
+# и ещё столько секунд считаем связь потерянной
+HEARTBEAT_GRACE = 5
+# Кодировка и сжатие, которые клиент просит у сервера; такой декодер понимает и JSON
+WIRE_ENCODING = "compact"
+WIRE_COMPRESSION = COMPRESSION
+# Токены сессий между запусками (сервер:порт:ник -> токен). По токену сервер узнаёт
+# владельца ника и только ему отдаёт личные сообщения, пришедшие, пока его не было
+SESSION_FILE = os.path.join(os.path.expanduser("~"), ".chat_sessions.json")
+
+
+def load_session_tokens(path):
+    try:
+        with open(path, encoding="utf-8") as file:
+            tokens = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return tokens if isinstance(tokens, dict) else {}
+
+
+def save_session_token(path, key, token):
+    tokens = load_session_tokens(path)
+    tokens[key] = token
+    try:
+        # Токен - это доступ к нику и его почте, поэтому файл читает только владелец
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as file:
+            json.dump(tokens, file)
+    except OSError:
+        pass
+
+
+class ChatClientCore:
+    """Клиент без интерфейса: всё, кроме показа.
+
+    Поток приёма только кладёт кадры в self.incoming, а разбирает их
+    process_incoming() в главном потоке интерфейса. Интерфейс переопределяет
+    render_pending (показ накопленных строк), set_status и при желании
+    update_connection_status и clear_chat.
+    """
+
+    def __init__(self, tls=None, session_file=SESSION_FILE):
+        self.client_socket = None
+        # SSL-контекст или None - обычный TCP; сессию TLS сохраняем, чтобы
+        # переподключение обходилось сокращённым рукопожатием
+        self.tls = tls
+        self.tls_session = None
+        self.nickname = ""
+        self.connected = False
+        self.host = "localhost"
+        self.port = 5555
+        self.frame_reader = None
+        self.room = DEFAULT_ROOM
+        # id самого старого показанного сообщения истории по комнатам
+        self.history_oldest = {}
+        # Список онлайн: приходит целиком один раз, дальше только изменения
+        self.online_users = {}
+        # Поток приёма только кладёт сюда сообщения, разбирает их главный поток
+        self.incoming = queue.Queue()
+        # Строки для показа: текст и тег вперемешку, как их принимает Text.insert
+        self.pending_lines = []
+        # Сессия: токен от сервера, комнаты и id последнего полученного сообщения
+        self.session = None
+        # None - токены между запусками не хранить
+        self.session_file = session_file
+        self.joined_rooms = {DEFAULT_ROOM}
+        self.last_id = None
+        # id недавних сообщений, чтобы не показать дважды то, что придёт и вживую, и в досылке
+        self.recent_ids = deque(maxlen=1000)
+        # Последний поиск и id самого старого найденного - для следующей страницы
+        self.last_search = None
+        self.search_oldest = None
+        self.reconnecting = False
+        self.stop_reconnect = threading.Event()
+        # Сколько /join и /leave ещё без ответа сервера и когда отправлен последний:
+        # пока комната меняется, консольный клиент придерживает ввод
+        self.room_requests = 0
+        self.room_requested_at = 0
+        # Отправляем в JSON, пока сервер не подтвердит кодировку в приветствии
+        self.codec = JSON_CODEC
+        self.decoder = get_codec(WIRE_ENCODING, WIRE_COMPRESSION)
+        # Пульс: интервал сообщает сервер в приветствии
+        self.ping_interval = None
+        self.last_received = time.monotonic()
+        self.ping_sent_at = 0
+
+    # --- Показ: переопределяется интерфейсом ---
+
+    def render_pending(self):
+        """Показывает накопленные строки; без интерфейса они просто отбрасываются"""
+        self.pending_lines = []
+
+    def set_status(self, text):
+        """Строка состояния подключения"""
+
+    def status_text(self):
+        lock = "🔒 " if self.tls is not None else ""
+        return (f"{lock}Подключено к {self.host}:{self.port} как {self.nickname} | "
+                f"#{self.room} | онлайн: {len(self.online_users)}")
+
+    def update_connection_status(self, connected):
+        self.set_status(self.status_text() if connected else "Не подключено")
+
+    def clear_chat(self):
+        self.pending_lines = []
+
+    def add_message_to_chat(self, message, tag="user_message"):
+        # Вызывается только из главного потока; на экран попадёт при ближайшей отрисовке
+        self.pending_lines.append(message + "\n")
+        self.pending_lines.append(tag)
+
+    # --- Подключение ---
+
+    def connect(self, host, port, nickname):
+        """Новый вход: комнаты и история с нуля, но с сохранённым токеном этого ника,
+        чтобы сервер отдал ждущие личные сообщения; ошибки подключения пробрасывает"""
+        self.host = host
+        self.port = port
+        self.nickname = nickname
+        self.session = self.saved_session()
+        self.last_id = None
+        self.recent_ids.clear()
+        self.tls_session = None
+        self.reset_session_state()
+        connection = self.open_connection()
+        self.connected = True
+        self.attach_socket(*connection)
+        self.update_connection_status(True)
+
+        self.add_message_to_chat("⚡ Подключение установлено!", "server")
+
+    def open_connection(self):
+        """Подключается и проходит рукопожатие (блокирующе); возвращает сокет и читатель кадров"""
+        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            client_socket.settimeout(5)
+            client_socket.connect((self.host, self.port))
+            if self.tls is not None:
+                client_socket = self.tls.wrap_socket(client_socket, server_hostname=self.host,
+                                                     session=self.tls_session)
+            frame_reader = FrameReader(client_socket)
+
+            # Обработка запроса ника; с токеном сессии просим вернуть ник, комнаты и пропущенное
+            if frame_reader.read_frame() == NICK_REQUEST:
+                if self.session:
+                    hello = encode_hello(self.nickname, encoding=WIRE_ENCODING, compression=WIRE_COMPRESSION,
+                                         heartbeat=True, session=self.session,
+                                         rooms=sorted(self.joined_rooms), last_id=self.last_id)
+                else:
+                    hello = encode_hello(self.nickname, encoding=WIRE_ENCODING, compression=WIRE_COMPRESSION,
+                                         heartbeat=True)
+                client_socket.sendall(hello)
+            client_socket.settimeout(None)
+        except Exception:
+            client_socket.close()
+            raise
+        return client_socket, frame_reader
+
+    def attach_socket(self, client_socket, frame_reader):
+        """Делает подключение текущим и запускает для него поток приёма"""
+        self.client_socket = client_socket
+        self.frame_reader = frame_reader
+        # Ответы на команды прежнего подключения уже не придут
+        self.room_requests = 0
+        self.ping_interval = None
+        self.last_received = time.monotonic()
+        receive_thread = threading.Thread(target=self.receive_messages, args=(frame_reader,))
+        receive_thread.daemon = True
+        receive_thread.start()
+
+    def session_key(self):
+        return f"{self.host}:{self.port}:{self.nickname}"
+
+    def saved_session(self):
+        if self.session_file is None:
+            return None
+        return load_session_tokens(self.session_file).get(self.session_key())
+
+    def remember_tls_session(self):
+        """Запоминает сессию TLS текущего подключения (у обычного сокета её нет)"""
+        session = getattr(self.client_socket, 'session', None)
+        if session is not None:
+            self.tls_session = session
+
+    def reset_session_state(self):
+        """Состояние нового (не восстановленного) входа: только #general"""
+        self.room = DEFAULT_ROOM
+        self.joined_rooms = {DEFAULT_ROOM}
+        self.history_oldest = {}
+        self.online_users = {}
+
+    def start_reconnect(self, reason="", first_delay=None):
+        """Связь пропала не по желанию пользователя: переподключаемся в фоне.
+
+        first_delay - задержка первой попытки, подсказанная сервером при остановке.
+        """
+        if not self.connected or self.reconnecting:
+            return
+        self.reconnecting = True
+        self.remember_tls_session()
+        try:
+            self.client_socket.close()
+        except:
+            pass
+        if reason:
+            self.add_message_to_chat(f"❌ {reason}", "error")
+        self.add_message_to_chat("🔄 Связь потеряна, переподключаемся...", "server")
+        self.set_status(f"Переподключение к {self.host}:{self.port}...")
+        # У каждой серии попыток свой флаг остановки, чтобы «Отключиться» её точно прервал
+        self.stop_reconnect = threading.Event()
+        threading.Thread(target=self.reconnect_loop, args=(self.stop_reconnect, first_delay),
+                         daemon=True).start()
+
+    def reconnect_loop(self, stop, first_delay=None):
+        """Фоновый поток: попытки с задержкой random(0, min(max, base * 2^n))"""
+        attempt = 0
+        while not stop.is_set():
+            if attempt == 0 and first_delay is not None:
+                delay = min(RECONNECT_MAX_DELAY, first_delay)
+            else:
+                delay = random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt))
+            if stop.wait(delay):
+                return
+            try:
+                connection = self.open_connection()
+            except Exception:
+                attempt += 1
+                self.incoming.put({"type": "reconnecting", "attempt": attempt})
+                continue
+            self.incoming.put({"type": "reconnected", "connection": connection, "stop": stop})
+            return
+
+    def disconnect(self):
+        if self.connected:
+            self.connected = False
+            self.reconnecting = False
+            self.stop_reconnect.set()
+            try:
+                self.client_socket.close()
+            except:
+                pass
+
+            self.update_connection_status(False)
+            self.add_message_to_chat("⚡ Отключено от сервера", "server")
+
+    # --- Приём ---
+
+    def receive_messages(self, frame_reader):
+        error = ""
+        while self.connected:
+            try:
+                frame = frame_reader.read_frame()
+                if frame is None:
+                    break
+
+                self.last_received = time.monotonic()
+                self.incoming.put(self.decoder.decode(frame))
+
+            except Exception as e:
+                error = f"Ошибка соединения: {e}"
+                break
+
+        # Отключение обработает главный поток, как и любое другое сообщение
+        if self.connected:
+            self.incoming.put({"type": "connection_lost", "message": error, "reader": frame_reader})
+
+    def process_incoming(self):
+        """Один проход главного цикла: разбирает пачку входящих и показывает всё разом"""
+        try:
+            for _ in range(MAX_BATCH):
+                self.handle_received_message(self.incoming.get_nowait())
+        except queue.Empty:
+            pass
+        self.check_heartbeat()
+        self.render_pending()
+
+    def check_heartbeat(self):
+        """Долго нет вестей от сервера: сначала ping, потом переподключение"""
+        if not self.connected or self.reconnecting or not self.ping_interval:
+            return
+        silent = time.monotonic() - self.last_received
+        if silent > 2 * self.ping_interval + HEARTBEAT_GRACE:
+            self.start_reconnect("Сервер не отвечает")
+        elif silent > self.ping_interval and self.ping_sent_at < self.last_received:
+            self.ping_sent_at = time.monotonic()
+            self.send_command_data({"type": "ping"})
+
+    def handle_received_message(self, message_data):
+        msg_type = message_data.get('type', 'message')
+        sender = message_data.get('sender', 'UNKNOWN')
+        message = message_data.get('message', '')
+        timestamp = message_data.get('timestamp', '')
+        room = message_data.get('room', DEFAULT_ROOM)
+
+        if msg_type == 'connection_lost':
+            # Сообщение от потока уже заменённого подключения не в счёт
+            if message_data.get('reader') is self.frame_reader:
+                self.start_reconnect(message)
+        elif msg_type == 'reconnecting':
+            self.set_status(f"Переподключение к {self.host}:{self.port}... "
+                            f"(попытка {message_data['attempt'] + 1})")
+        elif msg_type == 'reconnected':
+            client_socket, frame_reader = message_data['connection']
+            if message_data['stop'] is not self.stop_reconnect or message_data['stop'].is_set():
+                # Пользователь успел нажать «Отключиться»
+                client_socket.close()
+                return
+            self.reconnecting = False
+            self.attach_socket(client_socket, frame_reader)
+            if getattr(client_socket, 'session_reused', False):
+                self.add_message_to_chat("⚡ Подключение восстановлено! (сессия TLS возобновлена)", "server")
+            else:
+                self.add_message_to_chat("⚡ Подключение восстановлено!", "server")
+        elif msg_type == 'ping':
+            self.send_command_data({"type": "pong"})
+        elif msg_type == 'pong':
+            pass
+        elif msg_type == 'shutdown':
+            if message_data.get('restart'):
+                self.add_message_to_chat("♻️ Сервер перезапускается", "server")
+            else:
+                self.add_message_to_chat("⚡ Сервер остановлен", "error")
+            # Сервер сам назначает задержку, чтобы клиенты не вернулись все разом
+            self.start_reconnect(first_delay=message_data.get('reconnect_in'))
+        elif msg_type == 'welcome':
+            # Если ник был занят, сервер выдал другой
+            self.nickname = message_data.get('nickname', self.nickname)
+            self.session = message_data.get('session')
+            if self.session and self.session_file is not None:
+                save_session_token(self.session_file, self.session_key(), self.session)
+            # К приветствию билет TLS 1.3 уже пришёл - сессию можно возобновлять
+            self.remember_tls_session()
+            self.codec = get_codec(message_data.get('encoding'), message_data.get('compression'))
+            self.ping_interval = message_data.get('ping_interval')
+            if not message_data.get('resumed'):
+                self.reset_session_state()
+            self.update_connection_status(True)
+            self.add_message_to_chat(f"⭐ {message}", "welcome")
+            # После восстановления сессии пропущенное досылает сам сервер, но только
+            # если было что-то получено (новый вход с сохранённым токеном - историю грузим сами)
+            if not message_data.get('resumed') or self.last_id is None:
+                self.request_history(DEFAULT_ROOM)
+            self.send_command_data({"type": "command", "command": "users"})
+        elif msg_type == 'error':
+            # Например, превышен лимит сообщений - само сообщение сервер не разослал
+            self.room_reply(message_data)
+            self.add_message_to_chat(f"⛔ {message}", "error")
+        elif msg_type == 'history':
+            self.show_history(message_data)
+        elif msg_type == 'search':
+            self.show_search_results(message_data)
+        elif msg_type == 'private':
+            self.show_private_message(message_data)
+        elif msg_type == 'offline':
+            self.add_message_to_chat("✉️ Пока вас не было, вам написали:", "info")
+            for item in message_data.get('messages', []):
+                self.show_private_message(item)
+        elif msg_type == 'users':
+            self.online_users = dict.fromkeys(message_data.get('users', []))
+            self.update_connection_status(True)
+            self.show_users()
+        elif msg_type == 'presence':
+            if message_data.get('event') == 'join':
+                self.online_users[message_data.get('nickname')] = None
+            else:
+                self.online_users.pop(message_data.get('nickname'), None)
+            self.update_connection_status(True)
+        elif msg_type == 'info':
+            self.room_reply(message_data)
+            event = message_data.get('event')
+            if event == 'joined':
+                self.room = room
+                self.joined_rooms.add(room)
+                self.update_connection_status(True)
+                self.request_history(room)
+            elif event == 'left':
+                self.joined_rooms.discard(room)
+                if room == self.room:
+                    self.room = DEFAULT_ROOM
+                    self.update_connection_status(True)
+            self.add_message_to_chat(f"ℹ️  {message}", "info")
+        else:
+            message_id = message_data.get('id')
+            if message_id is not None:
+                self.recent_ids.append(message_id)
+                self.acknowledge(message_id)
+            self.show_chat_message(sender, message, timestamp, room)
+
+    def room_reply(self, message_data):
+        """Ответ на /join или /leave - удачный или нет"""
+        if message_data.get('command') in ('join', 'leave') and self.room_requests:
+            self.room_requests -= 1
+
+    def show_chat_message(self, sender, message, timestamp, room):
+        prefix = f"[{timestamp}]" if room == DEFAULT_ROOM else f"[{timestamp}] #{room}"
+        if sender == "SERVER":
+            self.add_message_to_chat(f"{prefix} ⚡ {message}", "server")
+        elif sender == self.nickname:
+            self.add_message_to_chat(f"{prefix} Вы: {message}", "my_message")
+        else:
+            self.add_message_to_chat(f"{prefix} {sender}: {message}", "user_message")
+
+    def acknowledge(self, message_id):
+        """Запоминает id последнего полученного сообщения: с него начнётся досылка"""
+        if self.last_id is None or message_id > self.last_id:
+            self.last_id = message_id
+
+    def show_users(self):
+        users = ", ".join(self.online_users)
+        self.add_message_to_chat(f"👥 Онлайн ({len(self.online_users)}): {users}", "info")
+
+    def show_history(self, message_data):
+        room = message_data.get('room', DEFAULT_ROOM)
+        messages = message_data.get('messages', [])
+        if message_data.get('replay'):
+            self.show_replay(room, messages, message_data.get('more'))
+            return
+        if not messages:
+            return
+        self.history_oldest[room] = messages[0]['id']
+        self.acknowledge(messages[-1]['id'])
+        self.add_message_to_chat(f"🕘 История #{room}:", "info")
+        for item in messages:
+            self.add_message_to_chat(f"[{item['timestamp']}] {item['sender']}: {item['message']}", "history")
+        if message_data.get('more'):
+            self.add_message_to_chat("🕘 Есть сообщения старше, наберите /history", "info")
+
+    def show_replay(self, room, messages, more):
+        """Сообщения, пропущенные во время обрыва связи, показываем как обычные"""
+        for item in messages:
+            if item['id'] not in self.recent_ids:
+                self.recent_ids.append(item['id'])
+                self.show_chat_message(item['sender'], item['message'], item['timestamp'], room)
+            self.acknowledge(item['id'])
+        if more and messages:
+            # Пропущено больше одной страницы - дочитываем следующую
+            self.request_history(room, since=messages[-1]['id'], replay=True)
+
+    def show_private_message(self, message_data):
+        sender = message_data.get('sender', '')
+        text = message_data.get('message', '')
+        timestamp = message_data.get('timestamp', '')
+        if sender == self.nickname:
+            # Копия нашего же сообщения от сервера
+            note = " (не в сети, получит при входе)" if message_data.get('offline') else ""
+            self.add_message_to_chat(f"[{timestamp}] ✉️ вы → {message_data.get('recipient')}{note}: {text}", "private")
+        else:
+            self.add_message_to_chat(f"[{timestamp}] ✉️ {sender} → вам: {text}", "private")
+
+    def show_search_results(self, message_data):
+        results = message_data.get('results', [])
+        query = message_data.get('query', '')
+        if not results:
+            if self.search_oldest is None:
+                self.add_message_to_chat(f"🔎 По запросу «{query}» ничего не найдено", "info")
+            else:
+                self.add_message_to_chat("🔎 Больше результатов нет", "info")
+            return
+        self.search_oldest = results[-1]['id']
+        self.add_message_to_chat(f"🔎 Найдено по запросу «{query}» (сначала новые):", "info")
+        for item in results:
+            self.add_message_to_chat(f"[{item['timestamp']}] #{item['room']} {item['sender']}: {item['message']}",
+                                     "history")
+        if message_data.get('more'):
+            self.add_message_to_chat("🔎 Есть ещё результаты, наберите /search", "info")
+
+    # --- Отправка ---
+
+    def send_command_data(self, message_data):
+        try:
+            self.client_socket.sendall(self.codec.encode(message_data))
+        except Exception as e:
+            self.start_reconnect(f"Ошибка отправки: {e}")
+
+    def send_text(self, message):
+        """Строка, набранная пользователем: команда или сообщение в текущую комнату.
+
+        Возвращает True, если строка ушла и поле ввода можно очистить.
+        """
+        if self.reconnecting:
+            self.add_message_to_chat("⏳ Нет связи с сервером, идёт переподключение", "error")
+            return False
+        if message.startswith('/'):
+            return self.handle_command(message)
+        message_data = {
+            "type": "message",
+            "content": message,
+            "room": self.room,
+            "color": "black"
+        }
+        try:
+            self.client_socket.sendall(self.codec.encode(message_data))
+            return True
+        except Exception as e:
+            self.start_reconnect(f"Ошибка отправки: {e}")
+            return False
+
+    def request_search(self, query, before=None):
+        message_data = {
+            "type": "command",
+            "command": "search",
+            "query": query
+        }
+        if before is not None:
+            message_data["before"] = before
+        self.send_command_data(message_data)
+
+    def request_history(self, room, before=None, since=None, replay=False):
+        message_data = {
+            "type": "command",
+            "command": "history",
+            "room": room
+        }
+        if before is not None:
+            message_data["before"] = before
+        if since is not None:
+            message_data["since"] = since
+        if replay:
+            message_data["replay"] = True
+        self.send_command_data(message_data)
+
+    def handle_command(self, command):
+        """Выполняет команду; False - ошибка в команде, строку ввода не очищаем"""
+        if command == '/users':
+            message_data = {
+                "type": "command",
+                "command": "users"
+            }
+            self.send_command_data(message_data)
+        elif command.split()[0] in ('/join', '/leave'):
+            name, _, room = command.partition(' ')
+            # /leave без аргумента выходит из текущей комнаты
+            room = room.strip() or (self.room if name == '/leave' else '')
+            if not room:
+                self.add_message_to_chat("❌ Использование: /join <комната>", "error")
+                return False
+            message_data = {
+                "type": "command",
+                "command": name[1:],
+                "room": room
+            }
+            self.room_requests += 1
+            self.room_requested_at = time.monotonic()
+            self.send_command_data(message_data)
+        elif command == '/history':
+            self.request_history(self.room, self.history_oldest.get(self.room))
+        elif command.split()[0] == '/msg':
+            parts = command.split(None, 2)
+            if len(parts) < 3:
+                self.add_message_to_chat("❌ Использование: /msg <ник> <текст>", "error")
+                return False
+            self.send_command_data({"type": "private", "recipient": parts[1], "content": parts[2]})
+        elif command.split()[0] == '/search':
+            # /search слова [from:ник] [in:комната]; /search без слов - следующая страница
+            query = command[len('/search'):].strip()
+            if query:
+                self.last_search = query
+                self.search_oldest = None
+                self.request_search(query)
+            elif self.last_search and self.search_oldest is not None:
+                self.request_search(self.last_search, self.search_oldest)
+            else:
+                self.add_message_to_chat("❌ Использование: /search <слова> [from:ник] [in:комната]", "error")
+                return False
+        elif command == '/clear':
+            self.clear_chat()
+        else:
+            self.add_message_to_chat(f"❌ Неизвестная команда: {command}", "error")
+            return False
+        return True
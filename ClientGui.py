@@ -0,0 +1,207 @@
+# clientgui.py
+# Окно клиента чата на Tk поверх ClientCore. Client.py импортирует этот модуль
+# только когда нужно окно, поэтому tkinter не грузится в консольном режиме.
+import socket
+import tkinter as tk
+from tkinter import scrolledtext, messagebox, ttk
+
+from ClientCore import ChatClientCore
+
+# Как часто главный цикл Tk забирает входящие сообщения
+FLUSH_INTERVAL_MS = 50
+# Сколько строк хранить в окне чата; старые строки удаляются
+MAX_SCROLLBACK_LINES = 5000
+
+class ChatClient(ChatClientCore):
+    def __init__(self, tls=None):
+        super().__init__(tls)
+        
+        self.setup_gui()
+        
+    def setup_gui(self):
+        self.root = tk.Tk()
+        self.root.title("Мессенджер v2.0")
+        self.root.geometry("600x700")
+        self.root.resizable(True, True)
+        
+        # Стиль
+        style = ttk.Style()
+        style.configure("TButton", padding=6)
+        style.configure("TEntry", padding=6)
+        
+        self.create_connection_frame()
+        self.create_chat_frame()
+        self.create_status_bar()
+        
+        # Настройка тегов для цветного текста
+        self.setup_text_tags()
+        
+    def create_connection_frame(self):
+        connection_frame = ttk.LabelFrame(self.root, text="Подключение", padding=10)
+        connection_frame.pack(fill=tk.X, padx=10, pady=5)
+        
+        # Хост
+        ttk.Label(connection_frame, text="Хост:").grid(row=0, column=0, sticky=tk.W, padx=5)
+        self.host_entry = ttk.Entry(connection_frame, width=20)
+        self.host_entry.insert(0, "localhost")
+        self.host_entry.grid(row=0, column=1, padx=5)
+        
+        # Порт
+        ttk.Label(connection_frame, text="Порт:").grid(row=0, column=2, sticky=tk.W, padx=5)
+        self.port_entry = ttk.Entry(connection_frame, width=10)
+        self.port_entry.insert(0, "5555")
+        self.port_entry.grid(row=0, column=3, padx=5)
+        
+        # Кнопки подключения
+        self.connect_button = ttk.Button(connection_frame, text="Подключиться", 
+                                       command=self.connect_to_server)
+        self.connect_button.grid(row=0, column=4, padx=10)
+        
+        self.disconnect_button = ttk.Button(connection_frame, text="Отключиться", 
+                                          command=self.disconnect, state=tk.DISABLED)
+        self.disconnect_button.grid(row=0, column=5, padx=5)
+        
+        # Никнейм
+        ttk.Label(connection_frame, text="Никнейм:").grid(row=1, column=0, sticky=tk.W, padx=5, pady=5)
+        self.nickname_entry = ttk.Entry(connection_frame, width=20)
+        self.nickname_entry.insert(0, f"User_{id(self) % 1000}")
+        self.nickname_entry.grid(row=1, column=1, columnspan=2, padx=5, pady=5, sticky=tk.W+tk.E)
+        
+    def create_chat_frame(self):
+        chat_frame = ttk.LabelFrame(self.root, text="Чат", padding=10)
+        chat_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        
+        # Область чата
+        self.chat_area = scrolledtext.ScrolledText(chat_frame, wrap=tk.WORD, 
+                                                 state=tk.DISABLED, height=20)
+        self.chat_area.pack(fill=tk.BOTH, expand=True)
+        
+        # Панель ввода
+        input_frame = ttk.Frame(chat_frame)
+        input_frame.pack(fill=tk.X, pady=5)
+        
+        self.message_entry = ttk.Entry(input_frame)
+        self.message_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.message_entry.bind("<Return>", self.send_message)
+        
+        self.send_button = ttk.Button(input_frame, text="Отправить", 
+                                    command=self.send_message)
+        self.send_button.pack(side=tk.RIGHT, padx=(10, 0))
+        
+        # Кнопки команд
+        command_frame = ttk.Frame(chat_frame)
+        command_frame.pack(fill=tk.X)
+        
+        ttk.Button(command_frame, text="Список пользователей", 
+                  command=self.request_users).pack(side=tk.LEFT, padx=2)
+        ttk.Button(command_frame, text="Очистить чат", 
+                  command=self.clear_chat).pack(side=tk.LEFT, padx=2)
+        
+    def create_status_bar(self):
+        self.status_var = tk.StringVar()
+        self.status_var.set("Не подключено")
+        
+        status_bar = ttk.Label(self.root, textvariable=self.status_var, 
+                              relief=tk.SUNKEN, anchor=tk.W)
+        status_bar.pack(fill=tk.X, side=tk.BOTTOM)
+        
+    def setup_text_tags(self):
+        # Настройка цветов для разных типов сообщений
+        self.chat_area.tag_config("server", foreground="blue", font=('Arial', 9, 'italic'))
+        self.chat_area.tag_config("welcome", foreground="green", font=('Arial', 9, 'bold'))
+        self.chat_area.tag_config("error", foreground="red", font=('Arial', 9, 'bold'))
+        self.chat_area.tag_config("info", foreground="purple", font=('Arial', 9, 'italic'))
+        self.chat_area.tag_config("my_message", foreground="darkgreen", font=('Arial', 9))
+        self.chat_area.tag_config("user_message", foreground="black", font=('Arial', 9))
+        self.chat_area.tag_config("history", foreground="gray", font=('Arial', 9))
+        self.chat_area.tag_config("private", foreground="darkmagenta", font=('Arial', 9, 'bold'))
+        
+    def connect_to_server(self):
+        try:
+            host = self.host_entry.get().strip()
+            port = int(self.port_entry.get().strip())
+            nickname = self.nickname_entry.get().strip()
+            
+            if not nickname:
+                messagebox.showwarning("Предупреждение", "Введите никнейм!")
+                return
+            
+            self.connect(host, port, nickname)
+            
+        except socket.timeout:
+            messagebox.showerror("Ошибка", "Таймаут подключения к серверу")
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось подключиться: {e}")
+    
+    def set_status(self, text):
+        self.status_var.set(text)
+    
+    def update_connection_status(self, connected):
+        if connected:
+            self.connect_button.config(state=tk.DISABLED)
+            self.disconnect_button.config(state=tk.NORMAL)
+            self.host_entry.config(state=tk.DISABLED)
+            self.port_entry.config(state=tk.DISABLED)
+            self.nickname_entry.config(state=tk.DISABLED)
+        else:
+            self.connect_button.config(state=tk.NORMAL)
+            self.disconnect_button.config(state=tk.DISABLED)
+            self.host_entry.config(state=tk.NORMAL)
+            self.port_entry.config(state=tk.NORMAL)
+            self.nickname_entry.config(state=tk.NORMAL)
+        super().update_connection_status(connected)
+    
+    def process_incoming(self):
+        """Таймер главного цикла: разбирает пачку входящих и перерисовывает чат один раз"""
+        super().process_incoming()
+        self.root.after(FLUSH_INTERVAL_MS, self.process_incoming)
+    
+    def render_pending(self):
+        """Вставляет все накопленные строки одним insert и обрезает старую историю"""
+        if not self.pending_lines:
+            return
+        at_bottom = self.chat_area.yview()[1] >= 0.999
+        self.chat_area.config(state=tk.NORMAL)
+        self.chat_area.insert(tk.END, *self.pending_lines)
+        self.pending_lines = []
+        
+        lines = int(self.chat_area.index('end-1c').split('.')[0])
+        if lines > MAX_SCROLLBACK_LINES:
+            self.chat_area.delete('1.0', f'{lines - MAX_SCROLLBACK_LINES + 1}.0')
+        self.chat_area.config(state=tk.DISABLED)
+        
+        # Не дёргаем прокрутку, если пользователь читает что-то выше
+        if at_bottom:
+            self.chat_area.see(tk.END)
+    
+    def send_message(self, event=None):
+        if not self.connected:
+            messagebox.showwarning("Предупреждение", "Сначала подключитесь к серверу!")
+            return
+        
+        message = self.message_entry.get().strip()
+        if not message:
+            return
+        
+        if self.send_text(message):
+            self.message_entry.delete(0, tk.END)
+    
+    def request_users(self):
+        if self.connected:
+            self.handle_command('/users')
+    
+    def clear_chat(self):
+        super().clear_chat()
+        self.chat_area.config(state=tk.NORMAL)
+        self.chat_area.delete(1.0, tk.END)
+        self.chat_area.config(state=tk.DISABLED)
+    
+    def run(self):
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.root.after(FLUSH_INTERVAL_MS, self.process_incoming)
+        self.root.mainloop()
+    
+    def on_closing(self):
+        if self.connected:
+            self.disconnect()
+        self.root.destroy()
@@ -0,0 +1,110 @@
+# headless.py
+# Клиент чата без GUI на asyncio: для ботов, тестов и нагрузочных прогонов.
+# В одном процессе можно держать тысячи таких клиентов.
+import asyncio
+
+from Protocol import (NICK_REQUEST, DEFAULT_ROOM, HEADER_SIZE, JSON_CODEC, AsyncFrameReader,
+                      encode_hello, decode_message, get_codec)
+
+
+class HeadlessClient:
+    """Клиент без GUI: рукопожатие NICK, отправка и приём кадров"""
+
+    def __init__(self, nickname, host="localhost", port=5555, on_message=None, encoding="json",
+                 compression=None, heartbeat=True, tls=None, session=None):
+        self.nickname = nickname
+        self.host = host
+        self.port = port
+        # on_message(client, message_data) вызывается для каждого входящего кадра;
+        # без него сообщения копятся в self.messages
+        self.on_message = on_message
+        self.messages = asyncio.Queue()
+        self.reader = None
+        self.writer = None
+        self.frames = None
+        self.receive_task = None
+        self.connected = False
+        # Кодировка и сжатие запрашиваются в рукопожатии; до подтверждения шлём JSON
+        self.encoding = encoding
+        self.compression = compression
+        # С пульсом сервер шлёт ping и отключает молчащих; отвечаем сами в receive_loop
+        self.heartbeat = heartbeat
+        self.codec = JSON_CODEC
+        self.decoder = get_codec(encoding, compression)
+        self.bytes_received = 0
+        # SSL-контекст (Protocol.make_client_context) или None - обычный TCP
+        self.tls = tls
+        # Токен сессии из прошлого приветствия: по нему сервер возвращает ник и отдаёт его почту
+        self.session = session
+
+    async def connect(self, timeout=10):
+        """Подключается и проходит рукопожатие; возвращает ник, выданный сервером"""
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=self.tls), timeout)
+        self.frames = AsyncFrameReader(self.reader)
+
+        if await asyncio.wait_for(self.frames.read_frame(), timeout) != NICK_REQUEST:
+            raise ConnectionError("Сервер не запросил ник")
+        options = {}
+        if self.encoding != JSON_CODEC.name:
+            options["encoding"] = self.encoding
+        if self.compression:
+            options["compression"] = self.compression
+        if self.heartbeat:
+            options["heartbeat"] = True
+        if self.session:
+            options["session"] = self.session
+        self.writer.write(encode_hello(self.nickname, **options))
+
+        # Первый кадр после рукопожатия - приветствие с итоговым ником
+        welcome = decode_message(await asyncio.wait_for(self.frames.read_frame(), timeout))
+        if welcome.get('type') != 'welcome':
+            raise ConnectionError(f"Неожиданный ответ сервера: {welcome}")
+        self.nickname = welcome.get('nickname', self.nickname)
+        self.session = welcome.get('session')
+        self.codec = get_codec(welcome.get('encoding'), welcome.get('compression'))
+        self.connected = True
+        self.receive_task = asyncio.get_running_loop().create_task(self.receive_loop())
+        return welcome
+
+    async def receive_loop(self):
+        try:
+            while self.connected:
+                frame = await self.frames.read_frame()
+                if frame is None:
+                    break
+                self.bytes_received += len(frame) + HEADER_SIZE
+                message_data = self.decoder.decode(frame)
+                if message_data.get('type') == 'ping':
+                    self.writer.write(self.codec.encode({"type": "pong"}))
+                    continue
+                if self.on_message is not None:
+                    self.on_message(self, message_data)
+                else:
+                    self.messages.put_nowait(message_data)
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connected = False
+
+    async def send(self, message_data):
+        """Отправляет произвольный кадр и ждёт освобождения буфера сокета"""
+        self.writer.write(self.codec.encode(message_data))
+        await self.writer.drain()
+
+    async def send_message(self, content, room=DEFAULT_ROOM):
+        await self.send({"type": "message", "content": content, "room": room})
+
+    async def send_command(self, command, **fields):
+        await self.send(dict(fields, type="command", command=command))
+
+    async def close(self):
+        self.connected = False
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        if self.receive_task is not None:
+            self.receive_task.cancel()
@@ -0,0 +1,426 @@
+# history.py
+# Журнал сообщений чата в SQLite. Запись идёт пачками в фоновом потоке,
+# чтобы рассылка сообщений не ждала диска.
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Сколько личных сообщений может ждать одного получателя, пока он не в сети, сколько
+# можно разложить по всем ящикам с одного адреса (ник сменить легко, адрес - нет)
+# и сколько их может быть всего
+OFFLINE_LIMIT = 100
+OFFLINE_SENDER_LIMIT = 500
+OFFLINE_TOTAL_LIMIT = 100000
+# Если запись не удалась (база занята другим процессом и т.п.), пачка возвращается
+# в очередь и запись повторяется с растущей паузой; очередь при этом не больше
+# MAX_PENDING сообщений, самые старые сверх неё отбрасываются
+WRITE_RETRY_BASE = 0.5
+WRITE_RETRY_MAX = 30
+MAX_PENDING = 100000
+
+log = logging.getLogger("chat.history")
+
+# Для нескольких воркеров id = миллисекунды << 20 | номер в миллисекунде << 10 | id узла,
+# чтобы id были уникальны между процессами и примерно упорядочены по времени
+NODE_BITS = 10
+SEQUENCE_BITS = 10
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    room TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    message TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_room_id ON messages (room, id);
+CREATE TABLE IF NOT EXISTS offline_messages (
+    id INTEGER PRIMARY KEY,
+    recipient TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    message TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    created REAL NOT NULL,
+    origin TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS offline_messages_recipient ON offline_messages (recipient, id);
+CREATE TABLE IF NOT EXISTS nickname_owners (
+    nickname TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+# Ящики, созданные до учёта адреса отправителя, получают колонку origin
+OFFLINE_ORIGIN_SCHEMA = """
+DROP INDEX IF EXISTS offline_messages_sender;
+CREATE INDEX IF NOT EXISTS offline_messages_origin ON offline_messages (origin);
+"""
+
+# Полнотекстовый индекс FTS5 по тексту, отправителю и комнате. Текст хранится только
+# в messages (external content), а индекс пополняет триггер в той же транзакции, что и пачку
+# сообщений. Комната в индексе, чтобы MATCH сразу отсекал чужие комнаты, а не перебирал
+# все совпадения слова по всей базе
+SEARCH_COLUMNS = ("message", "sender", "room")
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    message, sender, room,
+    content='messages', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, message, sender, room) VALUES (new.id, new.message, new.sender, new.room);
+END;
+"""
+
+
+def quote_term(word):
+    return '"' + word.replace('"', '""') + '"'
+
+
+def build_search_query(text, rooms=()):
+    """Запрос пользователя -> выражение FTS5.
+
+    Все слова обязательны, from:ник ищет по отправителю, слово со звёздочкой на конце
+    ищется по началу (сообщ* -> сообщение, сообщения). Без звёздочки ищется слово
+    целиком: так запрос берёт из индекса один список, а не все слова с этим началом.
+    Каждое слово берётся в кавычки, так что синтаксис FTS5 (AND, NEAR и т.п.)
+    из запроса не срабатывает. rooms добавляет условие на колонку room: название
+    разбивается на слова, как и текст, так что точное совпадение комнаты всё равно
+    проверяет SQL. Пустая строка - искать нечего.
+    """
+    terms = []
+    for word in text.split():
+        column = "message"
+        if word.lower().startswith("from:"):
+            column, word = "sender", word[len("from:"):]
+        prefix = "*" if word.endswith("*") else ""
+        word = word.rstrip("*")
+        # Слово без букв и цифр токенизатор всё равно выбросит
+        if not any(ch.isalnum() for ch in word):
+            continue
+        terms.append(f'{column} : {quote_term(word)}{prefix}')
+    # Комната без букв и цифр в индексе пустая - тогда её отсеет только SQL
+    if terms and rooms and all(any(ch.isalnum() for ch in room) for room in rooms):
+        terms.append(f"room : ({' OR '.join('^' + quote_term(room) for room in sorted(rooms))})")
+    return " AND ".join(terms)
+
+
+class MessageHistory:
+    """Журнал сообщений: id выдаются сразу, запись на диск - пачками"""
+
+    def __init__(self, path="chat_history.db", batch_size=500, flush_interval=0.2, node_id=None):
+        if node_id is not None and not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f"node_id должен быть от 0 до {MAX_NODE_ID}")
+        self.path = path
+        self.node_id = node_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.pending = []
+        self.flushing = []
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.running = True
+        # Неудачные попытки записи и сообщения, отброшенные из переполненной очереди
+        self.write_errors = 0
+        self.dropped = 0
+
+        connection = self.connect()
+        connection.executescript(SCHEMA)
+        columns = [column[1] for column in connection.execute("PRAGMA table_info(offline_messages)")]
+        if "origin" not in columns:
+            connection.execute("ALTER TABLE offline_messages ADD COLUMN origin TEXT NOT NULL DEFAULT ''")
+        connection.executescript(OFFLINE_ORIGIN_SCHEMA)
+        self.searchable = self.create_search_index(connection)
+        row = connection.execute("SELECT MAX(id) FROM messages").fetchone()
+        self.next_id = (row[0] or 0) + 1
+        self.last_ms = (row[0] or 0) >> (NODE_BITS + SEQUENCE_BITS)
+        self.sequence = 0
+
+        self.writer_thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer_thread.start()
+
+    def connect(self):
+        """Отдельное соединение SQLite на каждый поток"""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path)
+            # Базу могут делить несколько процессов-воркеров
+            connection.execute("PRAGMA busy_timeout=5000")
+            # WAL позволяет читать историю, пока фоновый поток пишет
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    @staticmethod
+    def create_search_index(connection):
+        """Создаёт индекс поиска; базу, записанную до его появления (или индекс старой
+        схемы без комнаты), индексирует заново один раз.
+        False - SQLite собран без FTS5, тогда поиск просто выключен."""
+        try:
+            columns = tuple(column[0] for column in
+                            connection.execute("SELECT * FROM messages_fts LIMIT 0").description)
+        except sqlite3.OperationalError:
+            columns = None
+        try:
+            if columns is not None and columns != SEARCH_COLUMNS:
+                with connection:
+                    connection.execute("DROP TRIGGER IF EXISTS messages_fts_insert")
+                    connection.execute("DROP TABLE messages_fts")
+            connection.executescript(SEARCH_SCHEMA)
+            if columns != SEARCH_COLUMNS:
+                with connection:
+                    connection.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def append(self, room, sender, message, timestamp):
+        """Ставит сообщение в очередь на запись и возвращает его id"""
+        with self.lock:
+            message_id = self.allocate_id()
+            self.queue_row(message_id, room, sender, message, timestamp)
+        return message_id
+
+    def store(self, message_id, room, sender, message, timestamp):
+        """Ставит в очередь сообщение с id, который уже выдал другой узел.
+        Если база общая и узел его записал сам, повторная вставка просто пропустится."""
+        with self.lock:
+            self.queue_row(message_id, room, sender, message, timestamp)
+
+    def queue_row(self, message_id, room, sender, message, timestamp):
+        # Вызывается под self.lock
+        self.pending.append((message_id, room, sender, message, timestamp, time.time()))
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    def allocate_id(self):
+        # Вызывается под self.lock
+        if self.node_id is None:
+            message_id = self.next_id
+            self.next_id += 1
+            return message_id
+        now_ms = int(time.time() * 1000)
+        if now_ms > self.last_ms:
+            self.last_ms = now_ms
+            self.sequence = 0
+        else:
+            self.sequence += 1
+            if self.sequence >> SEQUENCE_BITS:
+                self.last_ms += 1
+                self.sequence = 0
+        return ((self.last_ms << SEQUENCE_BITS | self.sequence) << NODE_BITS) | self.node_id
+
+    def write_loop(self):
+        """Фоновый поток: сбрасывает накопленные сообщения одной транзакцией"""
+        failures = 0
+        while self.running:
+            if failures:
+                # После ошибки ждём паузу целиком: полная очередь её не сокращает, только close()
+                self.stopping.wait(min(WRITE_RETRY_MAX, WRITE_RETRY_BASE * 2 ** (failures - 1)))
+            else:
+                self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            failures = 0 if self.flush() else failures + 1
+        self.flush()
+
+    def flush(self):
+        """Пишет очередь на диск; False - не удалось, пачка вернулась в очередь"""
+        with self.lock:
+            batch, self.pending = self.pending, []
+            # Пока пачка пишется, чтение видит её в self.flushing
+            self.flushing = batch
+        if not batch:
+            return True
+        error = None
+        try:
+            connection = self.connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO messages (id, room, sender, message, timestamp, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    batch
+                )
+        except sqlite3.Error as e:
+            error = e
+        finally:
+            with self.lock:
+                self.flushing = []
+                if error is not None:
+                    self.pending[:0] = batch
+                    overflow = len(self.pending) - MAX_PENDING
+                    if overflow > 0:
+                        del self.pending[:overflow]
+                        self.dropped += overflow
+                    queued = len(self.pending)
+        if error is not None:
+            self.write_errors += 1
+            log.error("💾 Не удалось записать историю (%s), в очереди %d сообщений, отброшено всего %d",
+                      error, queued, self.dropped)
+            return False
+        return True
+
+    def fetch(self, room, limit=PAGE_SIZE, before=None, since=None):
+        """Страница истории комнаты.
+
+        Без since - последние limit сообщений (до before, если указан),
+        с since - первые limit сообщений после указанного id.
+        Возвращает (сообщения по возрастанию id, есть ли ещё).
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        # Сначала снимок ещё не записанных сообщений, потом запрос к базе:
+        # так ни одно сообщение не потеряется между ними, а дубли отсеем по id
+        with self.lock:
+            memory = [row for row in self.flushing + self.pending if row[1] == room]
+
+        if since is not None:
+            since = int(since)
+            rows = self.connect().execute(
+                "SELECT id, room, sender, message, timestamp, created FROM messages "
+                "WHERE room = ? AND id > ? ORDER BY id LIMIT ?",
+                (room, since, limit + 1)
+            ).fetchall()
+            rows = self.merge(rows, [row for row in memory if row[0] > since])[:limit + 1]
+            more = len(rows) > limit
+            rows = rows[:limit]
+        else:
+            upper = int(before) if before is not None else None
+            query = ("SELECT id, room, sender, message, timestamp, created FROM messages "
+                     "WHERE room = ? AND id < ? ORDER BY id DESC LIMIT ?")
+            rows = self.connect().execute(
+                query, (room, upper if upper is not None else 2 ** 63 - 1, limit + 1)
+            ).fetchall()
+            if upper is not None:
+                memory = [row for row in memory if row[0] < upper]
+            rows = self.merge(rows, memory)[-(limit + 1):]
+            more = len(rows) > limit
+            rows = rows[-limit:]
+
+        return [self.to_dict(row) for row in rows], more
+
+    def search(self, text, rooms, limit=PAGE_SIZE, before=None):
+        """Страница результатов поиска по комнатам rooms, от новых сообщений к старым.
+
+        Следующая страница - тот же запрос с before = id последнего результата: индекс
+        сразу идёт от этого id вниз и останавливается на limit совпадениях. Комнаты
+        входят в MATCH, так что совпадения в чужих комнатах индекс пропускает сам.
+        Возвращает (сообщения по убыванию id, есть ли ещё).
+        """
+        rooms = sorted(rooms)
+        query = build_search_query(text, rooms)
+        if not self.searchable or not query or not rooms:
+            return [], False
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        upper = int(before) if before is not None else 2 ** 63 - 1
+        rows = self.connect().execute(
+            "SELECT m.id, m.room, m.sender, m.message, m.timestamp, m.created "
+            "FROM messages_fts CROSS JOIN messages AS m ON m.id = messages_fts.rowid "
+            "WHERE messages_fts MATCH ? AND messages_fts.rowid < ? "
+            f"AND m.room IN ({', '.join('?' * len(rooms))}) "
+            "ORDER BY messages_fts.rowid DESC LIMIT ?",
+            (query, upper, *rooms, limit + 1)
+        ).fetchall()
+        return [self.to_dict(row) for row in rows[:limit]], len(rows) > limit
+
+    def bind_nickname(self, nickname, owner, ttl):
+        """Закрепляет ник за владельцем, первым занявшим его.
+
+        owner - владелец из токена сессии, который предъявил клиент, или None.
+        Свободный ник (или ник, чей владелец не заходил дольше ttl) достаётся
+        предъявившему токен или новому владельцу; почта, что лежала у ника до этого
+        (прежнего владельца или из ящиков до закрепления ников), удаляется.
+        Занятый ник продлевается только своему владельцу.
+        Возвращает владельца, за которым ник теперь закреплён, или None - ник чужой.
+        """
+        now = time.time()
+        connection = self.connect()
+        with connection:
+            row = connection.execute("SELECT owner, expires FROM nickname_owners WHERE nickname = ?",
+                                     (nickname,)).fetchone()
+            if row is not None and row[1] > now:
+                if row[0] != owner:
+                    return None
+            else:
+                connection.execute("DELETE FROM offline_messages WHERE recipient = ?", (nickname,))
+                owner = owner or os.urandom(8).hex()
+            connection.execute("INSERT OR REPLACE INTO nickname_owners (nickname, owner, expires) "
+                               "VALUES (?, ?, ?)", (nickname, owner, now + ttl))
+        return owner
+
+    def is_bound(self, nickname):
+        """Есть ли у ника действующий владелец (только таким ведётся ящик)"""
+        row = self.connect().execute("SELECT expires FROM nickname_owners WHERE nickname = ?",
+                                     (nickname,)).fetchone()
+        return row is not None and row[0] > time.time()
+
+    def queue_private(self, recipient, sender, message, timestamp, origin=""):
+        """Сохраняет личное сообщение для получателя не в сети.
+        Пишется сразу, а не пачкой: таких сообщений мало, а терять их нельзя.
+        origin - адрес отправителя, по нему считается лимит отправителя.
+        Возвращает None или причину отказа: 'mailbox_full' - полон ящик получателя,
+        'sender_limit' - с этого адреса отправлено слишком много, 'storage_full' - все ящики."""
+        connection = self.connect()
+        with connection:
+            limits = (
+                ("mailbox_full", "recipient = ?", (recipient,), OFFLINE_LIMIT),
+                ("sender_limit", "origin = ?", (origin,), OFFLINE_SENDER_LIMIT),
+                ("storage_full", "1", (), OFFLINE_TOTAL_LIMIT),
+            )
+            for reason, condition, params, limit in limits:
+                waiting = connection.execute(
+                    f"SELECT COUNT(*) FROM offline_messages WHERE {condition}", params).fetchone()[0]
+                if waiting >= limit:
+                    return reason
+            connection.execute(
+                "INSERT INTO offline_messages (recipient, sender, message, timestamp, created, origin) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (recipient, sender, message, timestamp, time.time(), origin)
+            )
+        return None
+
+    def take_private(self, recipient):
+        """Забирает из ящика и удаляет все сообщения, ждавшие получателя, по порядку"""
+        connection = self.connect()
+        with connection:
+            rows = connection.execute(
+                "SELECT id, sender, message, timestamp FROM offline_messages "
+                "WHERE recipient = ? ORDER BY id", (recipient,)).fetchall()
+            if rows:
+                connection.execute("DELETE FROM offline_messages WHERE recipient = ? AND id <= ?",
+                                   (recipient, rows[-1][0]))
+        return [{"sender": row[1], "recipient": recipient, "message": row[2], "timestamp": row[3]}
+                for row in rows]
+
+    @staticmethod
+    def merge(rows, memory):
+        """Объединяет строки из базы и из памяти без дублей, по возрастанию id"""
+        merged = {row[0]: row for row in rows}
+        for row in memory:
+            merged[row[0]] = row
+        return [merged[key] for key in sorted(merged)]
+
+    @staticmethod
+    def to_dict(row):
+        return {
+            "id": row[0],
+            "room": row[1],
+            "sender": row[2],
+            "message": row[3],
+            "timestamp": row[4]
+        }
+
+    def close(self):
+        """Останавливает фоновый поток, дописав всё из очереди"""
+        self.running = False
+        self.wakeup.set()
+        self.stopping.set()
+        self.writer_thread.join(timeout=5)
@@ -0,0 +1,117 @@
+# metrics.py
+# Счётчики, гистограммы и датчики сервера плюс локальный HTTP-эндпоинт
+# и периодический сброс статистики в лог.
+import bisect
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограмм длительности, в секундах
+DURATION_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+log = logging.getLogger("chat.metrics")
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: observe за O(log корзин)"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self):
+        labels = [f"le_{bound}" for bound in self.buckets] + ["inf"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.count,
+            "sum": round(self.total, 6),
+        }
+
+
+class Metrics:
+    """Потокобезопасный набор метрик сервера"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, function):
+        """Регистрирует датчик: функция вызывается только при снятии снимка"""
+        self.gauges[name] = function
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {name: histogram.snapshot() for name, histogram in self.histograms.items()}
+        gauges = {}
+        for name, function in self.gauges.items():
+            try:
+                gauges[name] = function()
+            except Exception as e:
+                gauges[name] = f"error: {e}"
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "counters": counters,
+            "gauges": gauges,
+            "histograms": histograms,
+        }
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.metrics.snapshot(), ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("admin: " + format, *args)
+
+
+def start_admin_server(metrics, host="127.0.0.1", port=8765):
+    """Запускает HTTP-эндпоинт GET /metrics в фоновом потоке"""
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_stats_dump(metrics, interval):
+    """Раз в interval секунд пишет снимок метрик в лог"""
+    stop = threading.Event()
+
+    def dump_loop():
+        while not stop.wait(interval):
+            log.info("stats %s", json.dumps(metrics.snapshot(), ensure_ascii=False))
+
+    threading.Thread(target=dump_loop, daemon=True).start()
+    return stop
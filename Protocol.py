@@ -0,0 +1,379 @@
+# protocol.py
+# Общий сетевой протокол для Server.py и Client.py:
+# каждый кадр = 4 байта длины (big-endian) + полезная нагрузка
+import struct
+import json
+import zlib
+from collections import deque
+
+HEADER = struct.Struct('!I')
+HEADER_SIZE = HEADER.size
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+RECV_CHUNK = 64 * 1024
+
+NICK_REQUEST = b"NICK"
+# Ник попадает в список онлайн, уведомления и логи - держим его коротким и печатным
+MAX_NICKNAME_LENGTH = 32
+DEFAULT_ROOM = "general"
+
+
+class ProtocolError(Exception):
+    """Нарушение формата кадров"""
+
+
+def encode_frame(payload):
+    """Упаковывает байты в кадр с префиксом длины"""
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Кадр слишком большой: {len(payload)} байт")
+    return HEADER.pack(len(payload)) + payload
+
+
+def encode_message(message_data):
+    """Сериализует словарь в JSON и упаковывает в кадр"""
+    return encode_frame(json.dumps(message_data).encode('utf-8'))
+
+
+def decode_message(payload):
+    """Разбирает полезную нагрузку кадра как JSON"""
+    return json.loads(payload.decode('utf-8'))
+
+
+def encode_hello(nickname, **options):
+    """Ответ клиента на NICK: без параметров - просто ник, как у старых клиентов"""
+    if not options:
+        return encode_frame(nickname.encode('utf-8'))
+    return encode_message(dict(options, nickname=nickname))
+
+
+def clean_nickname(nickname):
+    """Убирает управляющие символы и обрезает ник до MAX_NICKNAME_LENGTH"""
+    if not isinstance(nickname, str):
+        return ""
+    nickname = "".join(char for char in nickname if char.isprintable())
+    return nickname.strip()[:MAX_NICKNAME_LENGTH].strip()
+
+
+def decode_hello(payload):
+    """Разбирает ответ на NICK в словарь: {"nickname": ..., плюс параметры сессии}"""
+    text = payload.decode('utf-8').strip()
+    if text.startswith('{'):
+        try:
+            hello = json.loads(text)
+        except ValueError:
+            hello = None
+        if isinstance(hello, dict):
+            hello["nickname"] = clean_nickname(hello.get("nickname"))
+            return hello
+    return {"nickname": clean_nickname(text)}
+
+
+class FrameDecoder:
+    """Инкрементальный декодер: принимает куски потока и отдаёт целые кадры"""
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Добавляет данные в буфер и возвращает список готовых кадров"""
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        pos = 0
+        end = len(buffer)
+        while end - pos >= HEADER_SIZE:
+            (length,) = HEADER.unpack_from(buffer, pos)
+            if length > self.max_frame_size:
+                raise ProtocolError(f"Кадр слишком большой: {length} байт")
+            start = pos + HEADER_SIZE
+            if end - start < length:
+                break
+            frames.append(bytes(buffer[start:start + length]))
+            pos = start + length
+        # Сдвигаем буфер один раз на весь пакет кадров, а не на каждый кадр
+        if pos:
+            del buffer[:pos]
+        return frames
+
+
+class FrameReader:
+    """Читает кадры из блокирующего сокета, переиспользуя один буфер приёма"""
+
+    def __init__(self, sock, chunk_size=RECV_CHUNK):
+        self.sock = sock
+        self.decoder = FrameDecoder()
+        self.frames = deque()
+        self._chunk = bytearray(chunk_size)
+        self._view = memoryview(self._chunk)
+
+    def read_frame(self):
+        """Возвращает следующий кадр или None, если соединение закрыто"""
+        while not self.frames:
+            received = self.sock.recv_into(self._view)
+            if not received:
+                return None
+            self.frames.extend(self.decoder.feed(self._view[:received]))
+        return self.frames.popleft()
+
+
+class AsyncFrameReader:
+    """То же самое для asyncio.StreamReader"""
+
+    def __init__(self, reader, chunk_size=RECV_CHUNK):
+        self.reader = reader
+        self.chunk_size = chunk_size
+        self.decoder = FrameDecoder()
+        self.frames = deque()
+
+    async def read_frame(self):
+        """Возвращает следующий кадр или None, если соединение закрыто"""
+        while not self.frames:
+            data = await self.reader.read(self.chunk_size)
+            if not data:
+                return None
+            self.frames.extend(self.decoder.feed(data))
+        return self.frames.popleft()
+
+
+# Компактная кодировка (согласуется в рукопожатии): самые частые кадры - сообщения
+# чата - упакованы struct-заголовком и сырым UTF-8 вместо JSON с длинными ключами
+# и \uXXXX на каждую кириллическую букву. Остальные кадры остаются JSON:
+# полезная нагрузка JSON всегда начинается с '{', а компактная - с номера типа.
+JSON_START = ord('{')
+TAG_MESSAGE = 1
+TAG_SEND = 2
+# тип, флаги, id, длины: время, отправитель, комната; дальше строки и текст до конца кадра
+MESSAGE_HEADER = struct.Struct('!BBQBHB')
+# тип, длина комнаты; дальше комната и текст до конца кадра
+SEND_HEADER = struct.Struct('!BB')
+HAS_ID = 1
+HAS_ROOM = 2
+FROM_SERVER = 4
+MESSAGE_KEYS = frozenset(("type", "sender", "message", "timestamp", "room", "id"))
+SEND_KEYS = frozenset(("type", "content", "room", "color"))
+
+
+class JsonCodec:
+    """Кодировка по умолчанию: каждый кадр - JSON-объект"""
+    name = encoding = "json"
+    compression = None
+
+    def encode(self, message_data):
+        return encode_message(message_data)
+
+    def decode(self, payload):
+        return decode_message(payload)
+
+    def unpack(self, payload, max_size=MAX_FRAME_SIZE):
+        """Полезная нагрузка без сжатия (у этой кодировки его нет)"""
+        return payload
+
+    def decode_unpacked(self, payload):
+        """Разбирает то, что вернул unpack"""
+        return self.decode(payload)
+
+
+class CompactCodec(JsonCodec):
+    """Бинарная кодировка сообщений чата; всё остальное - как в JsonCodec"""
+    name = encoding = "compact"
+
+    def encode(self, message_data):
+        msg_type = message_data.get("type")
+        data = None
+        if msg_type == "message" and message_data.keys() <= MESSAGE_KEYS:
+            data = self.encode_chat(message_data)
+        elif msg_type == "message" and "content" in message_data and message_data.keys() <= SEND_KEYS:
+            data = self.encode_send(message_data)
+        # Что не влезает в заголовок компактного кадра, уходит обычным JSON
+        return data if data is not None else encode_message(message_data)
+
+    def encode_chat(self, message_data):
+        """Пакует сообщение чата; None - поле не строка или длиннее, чем вмещает заголовок"""
+        sender = message_data.get("sender")
+        text = message_data.get("message")
+        timestamp = message_data.get("timestamp")
+        room = message_data.get("room")
+        message_id = message_data.get("id")
+        if not (isinstance(sender, str) and isinstance(text, str) and isinstance(timestamp, str)
+                and (room is None or isinstance(room, str))
+                and (message_id is None or type(message_id) is int and 0 <= message_id < 1 << 64)):
+            return None
+        flags = 0
+        if sender == "SERVER":
+            flags |= FROM_SERVER
+            sender = b""
+        else:
+            sender = sender.encode('utf-8')
+        if room is not None:
+            flags |= HAS_ROOM
+            room = room.encode('utf-8')
+        else:
+            room = b""
+        if message_id is not None:
+            flags |= HAS_ID
+        timestamp = timestamp.encode('utf-8')
+        if len(timestamp) > 0xFF or len(sender) > 0xFFFF or len(room) > 0xFF:
+            return None
+        header = MESSAGE_HEADER.pack(TAG_MESSAGE, flags, message_id or 0,
+                                     len(timestamp), len(sender), len(room))
+        return encode_frame(b"".join((header, timestamp, sender, room, text.encode('utf-8'))))
+
+    def encode_send(self, message_data):
+        room = message_data.get("room", DEFAULT_ROOM)
+        content = message_data["content"]
+        if not (isinstance(room, str) and isinstance(content, str)):
+            return None
+        room = room.encode('utf-8')
+        if len(room) > 0xFF:
+            return None
+        return encode_frame(b"".join((SEND_HEADER.pack(TAG_SEND, len(room)), room, content.encode('utf-8'))))
+
+    def decode(self, payload):
+        tag = payload[0] if payload else JSON_START
+        if tag == JSON_START:
+            return decode_message(payload)
+        try:
+            return self.decode_packed(tag, payload)
+        except struct.error:
+            raise ProtocolError("Обрезанный компактный кадр")
+
+    def decode_packed(self, tag, payload):
+        if tag == TAG_MESSAGE:
+            _, flags, message_id, timestamp_len, sender_len, room_len = MESSAGE_HEADER.unpack_from(payload)
+            pos = MESSAGE_HEADER.size
+            timestamp = payload[pos:pos + timestamp_len].decode('utf-8')
+            pos += timestamp_len
+            sender = "SERVER" if flags & FROM_SERVER else payload[pos:pos + sender_len].decode('utf-8')
+            pos += sender_len
+            room = payload[pos:pos + room_len].decode('utf-8')
+            pos += room_len
+            message_data = {"sender": sender, "message": payload[pos:].decode('utf-8'),
+                            "timestamp": timestamp, "type": "message"}
+            if flags & HAS_ROOM:
+                message_data["room"] = room
+            if flags & HAS_ID:
+                message_data["id"] = message_id
+            return message_data
+        if tag == TAG_SEND:
+            _, room_len = SEND_HEADER.unpack_from(payload)
+            pos = SEND_HEADER.size
+            return {"type": "message", "room": payload[pos:pos + room_len].decode('utf-8'),
+                    "content": payload[pos + room_len:].decode('utf-8')}
+        raise ProtocolError(f"Неизвестный тип компактного кадра: {tag}")
+
+
+# Сжатие (тоже согласуется в рукопожатии): кадр больше порога уходит как
+# TAG_DEFLATE + deflate исходной полезной нагрузки. Каждый кадр сжимается отдельно,
+# без общего для подключения потока, поэтому рассылку достаточно сжать один раз
+# на всех получателей; короткие кадры выигрывают за счёт общего словаря.
+TAG_DEFLATE = 3
+COMPRESSION = "deflate"
+COMPRESS_THRESHOLD = 512
+# Словарь менять нельзя: он должен совпадать у клиента и сервера
+COMPRESSION_DICTIONARY = (
+    '{"type": "history", "room": "general", "messages": [], "more": false}'
+    '{"type": "message", "sender": "SERVER", "message": "", "timestamp": ""}'
+    '{"id": , "room": "", "sender": "", "message": "", "timestamp": ""}, '
+    '{"type": "users", "users": [], "count": }'
+    ' присоединился к чату! покинул чат вошёл в комнату вышел из комнаты '
+    'привет как дела что это да нет спасибо хорошо сегодня '
+).encode('utf-8')
+
+
+def inflate(data, max_size=MAX_FRAME_SIZE):
+    """Распаковывает сжатый кадр, не давая ему вырасти больше max_size байт"""
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=COMPRESSION_DICTIONARY)
+    try:
+        payload = decompressor.decompress(data, max_size)
+    except zlib.error as e:
+        raise ProtocolError(f"Не удалось распаковать кадр: {e}")
+    if decompressor.unconsumed_tail:
+        raise ProtocolError("Распакованный кадр слишком большой")
+    return payload
+
+
+class DeflateCodec:
+    """Обёртка над кодировкой: кадры длиннее порога сжимаются deflate"""
+    compression = COMPRESSION
+
+    def __init__(self, inner, threshold=COMPRESS_THRESHOLD, level=6):
+        self.inner = inner
+        self.threshold = threshold
+        self.level = level
+        self.encoding = inner.encoding
+        self.name = f"{inner.name}+{COMPRESSION}"
+
+    def encode(self, message_data):
+        frame = self.inner.encode(message_data)
+        if len(frame) - HEADER_SIZE < self.threshold:
+            return frame
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      zdict=COMPRESSION_DICTIONARY)
+        compressed = compressor.compress(memoryview(frame)[HEADER_SIZE:]) + compressor.flush()
+        # Несжимаемые данные (уже сжатое, случайное) отправляем как есть
+        if len(compressed) + 1 >= len(frame) - HEADER_SIZE:
+            return frame
+        return encode_frame(bytes((TAG_DEFLATE,)) + compressed)
+
+    def unpack(self, payload, max_size=MAX_FRAME_SIZE):
+        """Распаковывает сжатый кадр (не больше max_size байт), несжатый отдаёт как есть"""
+        if payload and payload[0] == TAG_DEFLATE:
+            return inflate(payload[1:], max_size)
+        return payload
+
+    def decode_unpacked(self, payload):
+        # Распакованное ещё раз не распаковывается: сжатое внутри сжатого - ошибка кодировки
+        return self.inner.decode(payload)
+
+    def decode(self, payload):
+        return self.decode_unpacked(self.unpack(payload))
+
+
+JSON_CODEC = JsonCodec()
+CODECS = {codec.name: codec for codec in (JSON_CODEC, CompactCodec())}
+_compressed_codecs = {}
+
+
+def get_codec(encoding=None, compression=None, threshold=COMPRESS_THRESHOLD):
+    """Кодировка по названию, со сжатием или без; неизвестная - JSON.
+    Экземпляры общие, чтобы EncodedMessage кэшировал кадр на всех получателей."""
+    codec = CODECS.get(encoding, JSON_CODEC)
+    if compression != COMPRESSION or not threshold:
+        return codec
+    key = (codec.name, threshold)
+    compressed = _compressed_codecs.get(key)
+    if compressed is None:
+        compressed = _compressed_codecs[key] = DeflateCodec(codec, threshold)
+    return compressed
+
+
+def choose_codec(hello, compress_threshold=COMPRESS_THRESHOLD):
+    """Кодировка и сжатие из рукопожатия клиента; compress_threshold=0 - сервер не сжимает"""
+    return get_codec(hello.get("encoding"), hello.get("compression"), compress_threshold)
+
+
+class EncodedMessage:
+    """Кадр для рассылки: сериализуется не больше одного раза на каждую кодировку"""
+
+    __slots__ = ("message_data", "frames")
+
+    def __init__(self, message_data):
+        self.message_data = message_data
+        self.frames = {}
+
+    def frame(self, codec):
+        data = self.frames.get(codec.name)
+        if data is None:
+            data = self.frames[codec.name] = codec.encode(self.message_data)
+        return data
+
+
+# TLS: тот же протокол кадров поверх ssl; сертификат сервер берёт из --tls-cert
+def make_client_context(cafile=None):
+    """SSL-контекст клиента: доверяем cafile (например, самоподписанному сертификату
+    сервера) или системным CA, имя хоста проверяется всегда"""
+    # ssl грузится только для TLS: консольный клиент и боты без него стартуют быстрее
+    import ssl
+    context = ssl.create_default_context(cafile=cafile)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    return context
@@ -1,36 +1,762 @@
 # server_fixed.py
 import socket
 import threading
+import asyncio
 import json
 from datetime import datetime
 import argparse
+import base64
+import hashlib
+import hmac
 import sys
+import time
+import logging
+import logging.handlers
+import math
+import queue
+import os
+import random
+import signal
+import ssl
+import subprocess
+import tempfile
+from collections import deque
+
+from Bus import BusBroker, SocketBus
+from History import MessageHistory, PAGE_SIZE, MAX_PAGE_SIZE, MAX_NODE_ID
+from Metrics import Metrics, start_admin_server, start_stats_dump
+from Protocol import (NICK_REQUEST, DEFAULT_ROOM, HEADER_SIZE, FrameReader, AsyncFrameReader,
+                      ProtocolError, JSON_CODEC, EncodedMessage, encode_frame, encode_message,
+                      decode_hello, choose_codec, COMPRESS_THRESHOLD)
+
+SLOW_CONSUMER_POLICIES = ('drop_oldest', 'disconnect')
+LOG_LEVELS = ('debug', 'info', 'warning', 'error', 'off')
+# Сколько секунд действует токен сессии (он же выдаётся заново при каждом входе)
+SESSION_TTL = 24 * 3600
+# Ограничения по умолчанию: сообщений в секунду и запас на всплеск
+RATE_LIMIT = 10
+RATE_BURST = 20
+ROOM_RATE_LIMIT = 200
+ROOM_BURST = 400
+# Общий предел входящего трафика, байт в секунду
+MAX_INBOUND_BYTES = 64 * 1024 * 1024
+# До скольких байт распаковывается сжатый кадр клиента: сообщению чата больше не нужно,
+# а без предела 16 КБ сжатых нулей превращаются в 16 МБ, которые надо разобрать и разослать
+MAX_INFLATED = 256 * 1024
+# Очередь клиента ограничена и по байтам: кадр бывает до 16 МБ, и тысяча таких - это 16 ГБ
+MAX_QUEUE_BYTES = 8 * 1024 * 1024
+# Сколько байт писатель склеивает в одну отправку, чтобы не копировать всю очередь разом
+WRITE_BATCH_BYTES = 256 * 1024
+# Пульс: после стольких секунд тишины клиенту уходит ping, а после IDLE_TIMEOUT он отключается
+PING_INTERVAL = 30
+IDLE_TIMEOUT = 90
+REAPER_TICK = 1.0
+TCP_KEEPALIVE = 60
+# Остановка: сколько секунд ждать, пока очереди клиентов уйдут в сеть, и за какое
+# окно клиентам предлагается вернуться (каждому своя случайная задержка)
+DRAIN_TIMEOUT = 5
+RECONNECT_SPREAD = 10
+# Сколько ждать TLS-рукопожатия от нового подключения
+TLS_HANDSHAKE_TIMEOUT = 10
+# Сколько ждать ответа на NICK: до входа подключение не стоит в колесе пульса,
+# и без срока молчащий сокет держал бы поток (или задачу и дескриптор) вечно
+HELLO_TIMEOUT = 10
+# Номер дескриптора слушающего сокета, переданного при горячем перезапуске
+LISTEN_FD_OPTION = '--listen-fd'
+PING_FRAME = encode_message({"type": "ping"})
+PONG_FRAME = encode_message({"type": "pong"})
+
+log = logging.getLogger("chat")
+
+def setup_logging(level='info'):
+    """Логирование через очередь: запись в консоль идёт в отдельном потоке, не тормозя обработку сообщений"""
+    if level == 'off':
+        log.disabled = True
+        return None
+    log.setLevel(level.upper())
+    log.propagate = False
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s", "%H:%M:%S"))
+    log_queue = queue.SimpleQueue()
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, console)
+    listener.start()
+    return listener
+
+class OutboundQueue:
+    """Учёт исходящей очереди: предел по числу кадров и по байтам.
+    В потоковом подключении вызывается под self.condition"""
+    
+    def overflows(self, size):
+        """Не влезает ли кадр размером size; в пустую очередь влезает любой"""
+        if not self.queue:
+            return False
+        return len(self.queue) >= self.max_queue or self.queued_bytes + size > self.max_queue_bytes
+    
+    def drop_oldest(self, size):
+        """Выкидывает старые кадры, пока новый не влезет"""
+        while self.overflows(size):
+            self.queued_bytes -= len(self.queue.popleft())
+            self.dropped += 1
+            self.metrics.inc('frames_dropped')
+    
+    def clear_queue(self):
+        self.queue.clear()
+        self.queued_bytes = 0
+    
+    def next_batch(self):
+        """Снимает с очереди кадры не больше чем на WRITE_BATCH_BYTES (но хотя бы один)"""
+        batch = [self.queue.popleft()]
+        size = len(batch[0])
+        while self.queue and size + len(self.queue[0]) <= WRITE_BATCH_BYTES:
+            frame = self.queue.popleft()
+            batch.append(frame)
+            size += len(frame)
+        self.queued_bytes -= size
+        return len(batch), b"".join(batch)
+
+class ClientConnection(OutboundQueue):
+    """Подключение клиента: ограниченная очередь исходящих кадров и поток-писатель"""
+    
+    def __init__(self, sock, address, max_queue=1000, policy='drop_oldest', metrics=None,
+                 max_queue_bytes=MAX_QUEUE_BYTES):
+        self.sock = sock
+        self.address = address
+        self.nickname = None
+        self.max_queue = max_queue
+        self.max_queue_bytes = max_queue_bytes
+        self.policy = policy
+        self.metrics = metrics or Metrics()
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.dropped = 0
+        self.closed = False
+        # Кодировка кадров, выбранная клиентом в рукопожатии
+        self.codec = JSON_CODEC
+        # Ведро токенов на входящие сообщения; None - без ограничения
+        self.bucket = None
+        # Когда от клиента последний раз что-то приходило (для пульса)
+        self.last_seen = time.monotonic()
+        self.heartbeat = False
+        self.close_reason = None
+        self.condition = threading.Condition()
+        self.writer_thread = threading.Thread(target=self.write_loop, daemon=True)
+    
+    def start(self, first=None):
+        """Запускает поток-писатель; first - кадр, который уйдёт раньше уже поставленных в очередь"""
+        if first is not None:
+            with self.condition:
+                self.queue.appendleft(first)
+                self.queued_bytes += len(first)
+        self.writer_thread.start()
+    
+    def send(self, data):
+        """Ставит кадр в очередь; False значит, что клиента надо отключить"""
+        with self.condition:
+            if self.closed:
+                return False
+            if self.overflows(len(data)):
+                if self.policy == 'disconnect':
+                    self.closed = True
+                    self.close_reason = 'slow_consumer'
+                    self.clear_queue()
+                    self.condition.notify()
+                    return False
+                self.drop_oldest(len(data))
+            self.queue.append(data)
+            self.queued_bytes += len(data)
+            self.condition.notify()
+        return True
+    
+    def write_loop(self):
+        """Отправляет накопленные кадры одним вызовом sendall"""
+        try:
+            while True:
+                with self.condition:
+                    while not self.queue and not self.closed:
+                        self.condition.wait()
+                    if not self.queue:
+                        break
+                    frames, data = self.next_batch()
+                self.sock.sendall(data)
+                self.metrics.inc('frames_out', frames)
+                self.metrics.inc('bytes_out', len(data))
+        except OSError:
+            pass
+        finally:
+            self.closed = True
+            self.shutdown_socket()
+    
+    def close(self):
+        """Закрывает подключение после отправки уже поставленных в очередь кадров"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if not self.writer_thread.is_alive():
+            self.shutdown_socket()
+    
+    def abort(self):
+        """Закрывает сокет сразу, не дожидаясь отправки очереди (клиент уже не отвечает)"""
+        with self.condition:
+            self.closed = True
+            self.clear_queue()
+            self.condition.notify()
+        self.shutdown_socket()
+    
+    def shutdown_socket(self):
+        try:
+            # shutdown будит поток-читатель, заблокированный в recv
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class AsyncClientConnection(OutboundQueue):
+    """То же подключение для asyncio: очередь разбирает задача-писатель"""
+    
+    def __init__(self, writer, address, max_queue=1000, policy='drop_oldest', metrics=None,
+                 max_queue_bytes=MAX_QUEUE_BYTES):
+        self.writer = writer
+        self.address = address
+        self.nickname = None
+        self.max_queue = max_queue
+        self.max_queue_bytes = max_queue_bytes
+        self.policy = policy
+        self.metrics = metrics or Metrics()
+        self.queue = deque()
+        self.queued_bytes = 0
+        self.dropped = 0
+        self.closed = False
+        # Кодировка кадров, выбранная клиентом в рукопожатии
+        self.codec = JSON_CODEC
+        # Ведро токенов на входящие сообщения; None - без ограничения
+        self.bucket = None
+        # Когда от клиента последний раз что-то приходило (для пульса)
+        self.last_seen = time.monotonic()
+        self.heartbeat = False
+        self.close_reason = None
+        self.ready = asyncio.Event()
+        self.writer_task = None
+    
+    def start(self, first=None):
+        """Запускает задачу-писатель; first - кадр, который уйдёт раньше уже поставленных в очередь"""
+        if first is not None:
+            self.queue.appendleft(first)
+            self.queued_bytes += len(first)
+        self.writer_task = asyncio.get_running_loop().create_task(self.write_loop())
+    
+    def send(self, data):
+        """Ставит кадр в очередь; False значит, что клиента надо отключить"""
+        if self.closed or self.writer.is_closing():
+            return False
+        if self.overflows(len(data)):
+            if self.policy == 'disconnect':
+                self.closed = True
+                self.close_reason = 'slow_consumer'
+                self.clear_queue()
+                self.ready.set()
+                return False
+            self.drop_oldest(len(data))
+        self.queue.append(data)
+        self.queued_bytes += len(data)
+        self.ready.set()
+        return True
+    
+    async def write_loop(self):
+        """Отправляет накопленные кадры и ждёт, пока буфер транспорта опустеет"""
+        try:
+            while True:
+                if not self.queue:
+                    if self.closed:
+                        break
+                    await self.ready.wait()
+                    self.ready.clear()
+                    continue
+                frames, data = self.next_batch()
+                self.writer.write(data)
+                self.metrics.inc('frames_out', frames)
+                self.metrics.inc('bytes_out', len(data))
+                await self.writer.drain()
+        except (OSError, asyncio.CancelledError):
+            pass
+        finally:
+            self.closed = True
+            self.writer.close()
+    
+    def close(self):
+        """Закрывает подключение после отправки уже поставленных в очередь кадров"""
+        self.closed = True
+        self.ready.set()
+        if self.writer_task is None:
+            self.writer.close()
+    
+    def abort(self):
+        """Закрывает соединение сразу, не дожидаясь отправки очереди"""
+        self.closed = True
+        self.clear_queue()
+        self.ready.set()
+        self.writer.transport.abort()
+
+class ClientRegistry:
+    """Потокобезопасный реестр подключений с индексами по подключению и по нику"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_nickname = {}
+        self.by_connection = {}
+        # Следующий свободный суффикс для каждого базового ника
+        self.suffix_counters = {}
+        self.snapshot_cache = ()
+        self.snapshot_dirty = False
+    
+    def add(self, connection, nickname):
+        """Атомарно выбирает свободный ник и регистрирует подключение"""
+        with self.lock:
+            if nickname in self.by_nickname:
+                base = nickname
+                counter = self.suffix_counters.get(base, 1)
+                nickname = f"{base}_{counter}"
+                while nickname in self.by_nickname:
+                    counter += 1
+                    nickname = f"{base}_{counter}"
+                self.suffix_counters[base] = counter + 1
+            self.by_nickname[nickname] = connection
+            self.by_connection[connection] = nickname
+            self.snapshot_dirty = True
+            return nickname
+    
+    def remove(self, connection):
+        """Удаляет подключение; возвращает его ник или None, если его уже нет"""
+        with self.lock:
+            nickname = self.by_connection.pop(connection, None)
+            if nickname is None:
+                return None
+            del self.by_nickname[nickname]
+            if not self.by_connection:
+                self.suffix_counters.clear()
+            self.snapshot_dirty = True
+            return nickname
+    
+    def get(self, nickname):
+        return self.by_nickname.get(nickname)
+    
+    def nickname_of(self, connection):
+        return self.by_connection.get(connection)
+    
+    def snapshot(self):
+        """Неизменяемый срез подключений для обхода без блокировки"""
+        with self.lock:
+            if self.snapshot_dirty:
+                self.snapshot_cache = tuple(self.by_connection)
+                self.snapshot_dirty = False
+            return self.snapshot_cache
+    
+    def nicknames(self):
+        with self.lock:
+            return list(self.by_nickname)
+    
+    def clear(self):
+        with self.lock:
+            self.by_nickname.clear()
+            self.by_connection.clear()
+            self.suffix_counters.clear()
+            self.snapshot_cache = ()
+            self.snapshot_dirty = False
+    
+    def __contains__(self, connection):
+        return connection in self.by_connection
+    
+    def __len__(self):
+        return len(self.by_connection)
+
+MAX_ROOM_NAME = 32
+
+def normalize_room(name):
+    """Приводит название комнаты к виду без # и пробелов; None если имя негодное"""
+    name = (name or "").strip().lstrip('#').lower()
+    if not name or len(name) > MAX_ROOM_NAME or any(ch.isspace() for ch in name):
+        return None
+    return name
+
+class RoomIndex:
+    """Индекс подписок: комната -> участники и подключение -> его комнаты"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.members = {}
+        self.memberships = {}
+        self.snapshots = {}
+    
+    def join(self, connection, room):
+        """Добавляет подключение в комнату; False если оно уже там"""
+        with self.lock:
+            members = self.members.setdefault(room, set())
+            if connection in members:
+                return False
+            members.add(connection)
+            self.memberships.setdefault(connection, set()).add(room)
+            self.snapshots.pop(room, None)
+            return True
+    
+    def leave(self, connection, room):
+        """Убирает подключение из комнаты; False если его там не было"""
+        with self.lock:
+            members = self.members.get(room)
+            if not members or connection not in members:
+                return False
+            self.discard(connection, room)
+            rooms = self.memberships.get(connection)
+            if rooms is not None:
+                rooms.discard(room)
+                if not rooms:
+                    del self.memberships[connection]
+            return True
+    
+    def leave_all(self, connection):
+        """Убирает подключение из всех комнат и возвращает их список"""
+        with self.lock:
+            rooms = self.memberships.pop(connection, set())
+            for room in rooms:
+                self.discard(connection, room)
+            return rooms
+    
+    def discard(self, connection, room):
+        # Вызывается под self.lock
+        members = self.members[room]
+        members.discard(connection)
+        if not members:
+            del self.members[room]
+        self.snapshots.pop(room, None)
+    
+    def is_member(self, connection, room):
+        return connection in self.members.get(room, ())
+    
+    def rooms_of(self, connection):
+        with self.lock:
+            return set(self.memberships.get(connection, ()))
+    
+    def snapshot(self, room):
+        """Неизменяемый срез участников комнаты для рассылки"""
+        with self.lock:
+            members = self.snapshots.get(room)
+            if members is None:
+                members = tuple(self.members.get(room, ()))
+                self.snapshots[room] = members
+            return members
+
+class Roster:
+    """Список пользователей онлайн с кэшем уже сериализованного ответа на /users"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        # ник -> его JSON-представление; dict хранит порядок входа,
+        # добавление и удаление за O(1)
+        self.nicknames = {}
+        self.cached_frame = None
+    
+    def add(self, nickname):
+        with self.lock:
+            self.nicknames[nickname] = json.dumps(nickname)
+            self.cached_frame = None
+    
+    def remove(self, nickname):
+        with self.lock:
+            self.nicknames.pop(nickname, None)
+            self.cached_frame = None
+    
+    def frame(self):
+        """Кадр ответа на /users; пересобирается только после изменения списка"""
+        with self.lock:
+            if self.cached_frame is None:
+                # Склеиваем уже сериализованные ники, не прогоняя весь список через json.dumps
+                payload = '{"type": "users", "users": [%s], "count": %d}' % (
+                    ", ".join(self.nicknames.values()), len(self.nicknames))
+                self.cached_frame = encode_frame(payload.encode('utf-8'))
+            return self.cached_frame
+    
+    def __contains__(self, nickname):
+        return nickname in self.nicknames
+    
+    def __len__(self):
+        return len(self.nicknames)
+
+class TokenBucket:
+    """Ведро токенов: пополняется на rate в секунду, но не больше burst; проверка за O(1)"""
+    
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def refill(self):
+        # Вызывается под self.lock
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def try_take(self, amount=1):
+        """Берёт токены, если их хватает, и возвращает 0; иначе - через сколько секунд хватит"""
+        with self.lock:
+            self.refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0
+            return (amount - self.tokens) / self.rate
+    
+    def take_or_wait(self, amount):
+        """Берёт токены в долг и возвращает, сколько надо подождать, пока долг не погасится"""
+        with self.lock:
+            self.refill()
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+class TimerWheel:
+    """Колесо таймеров: schedule и advance за O(1) на подключение, без сортировки.
+    Срок округляется вверх до тика; слишком дальний ставится в последний слот
+    и просто проверяется ещё раз."""
+    
+    def __init__(self, horizon, tick=REAPER_TICK):
+        self.tick = tick
+        self.slots = [set() for _ in range(int(math.ceil(horizon / tick)) + 1)]
+        self.position = 0
+        self.slot_of = {}
+        self.lock = threading.Lock()
+    
+    def schedule(self, item, delay):
+        """Ставит (или переставляет) item на срок через delay секунд"""
+        ticks = min(len(self.slots) - 1, max(1, int(math.ceil(delay / self.tick))))
+        with self.lock:
+            old = self.slot_of.get(item)
+            if old is not None:
+                old.discard(item)
+            slot = self.slots[(self.position + ticks) % len(self.slots)]
+            slot.add(item)
+            self.slot_of[item] = slot
+    
+    def discard(self, item):
+        with self.lock:
+            slot = self.slot_of.pop(item, None)
+            if slot is not None:
+                slot.discard(item)
+    
+    def advance(self):
+        """Сдвигает колесо на один тик и возвращает всё, чей срок подошёл"""
+        with self.lock:
+            self.position = (self.position + 1) % len(self.slots)
+            due = self.slots[self.position]
+            self.slots[self.position] = set()
+            for item in due:
+                del self.slot_of[item]
+            return due
+    
+    def __len__(self):
+        return len(self.slot_of)
+
+def enable_keepalive(sock, idle=TCP_KEEPALIVE):
+    """Включает TCP keepalive: ядро само найдёт пропавшего собеседника, даже без пульса"""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # Тонкие настройки есть не везде (Linux, новые Windows и macOS)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+        if hasattr(socket, 'TCP_KEEPINTVL'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, idle // 4))
+        if hasattr(socket, 'TCP_KEEPCNT'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4)
+    except OSError:
+        pass
+
+def make_server_context(certfile, keyfile=None):
+    """SSL-контекст сервера. Билеты сессий (session tickets) OpenSSL выдаёт сам,
+    поэтому переподключившийся клиент проходит сокращённое рукопожатие"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+def make_bucket(rate, burst=None):
+    """Ведро или None, если ограничение выключено (rate=0)"""
+    return TokenBucket(rate, burst) if rate > 0 else None
+
+def load_session_key(path):
+    """Читает ключ подписи сессий из файла, при первом запуске создаёт его"""
+    try:
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'rb') as key_file:
+            return key_file.read()
+    key = os.urandom(32).hex().encode('ascii')
+    with os.fdopen(descriptor, 'wb') as key_file:
+        key_file.write(key)
+    return key
+
+def new_owner():
+    """Случайный идентификатор владельца ника (16 шестнадцатеричных символов)"""
+    return os.urandom(8).hex()
+
+class SessionTokens:
+    """Токены сессии, подписанные HMAC: на сервере ничего не хранится,
+    поэтому после перезапуска (с тем же ключом) клиент возвращает свой ник.
+    В токене есть и владелец ника - по нему история узнаёт, чей это ящик."""
+    
+    def __init__(self, key, ttl=SESSION_TTL):
+        self.key = key
+        self.ttl = ttl
+    
+    def sign(self, payload):
+        return hmac.new(self.key, payload, hashlib.sha256).hexdigest()[:32]
+    
+    def issue(self, nickname, owner):
+        payload = f"{int(time.time())}:{owner}:{nickname}".encode('utf-8')
+        return base64.urlsafe_b64encode(payload).decode('ascii') + "." + self.sign(payload)
+    
+    def verify_owner(self, token):
+        """Возвращает (ник, владелец) из действующего токена или None"""
+        if not isinstance(token, str) or "." not in token:
+            return None
+        encoded, _, signature = token.rpartition(".")
+        try:
+            payload = base64.urlsafe_b64decode(encoded.encode('ascii'))
+            issued, _, rest = payload.decode('utf-8').partition(":")
+            owner, _, nickname = rest.partition(":")
+            issued = int(issued)
+        except (ValueError, UnicodeError):
+            return None
+        if not hmac.compare_digest(signature, self.sign(payload)):
+            return None
+        # Токены старого вида (без владельца) не подходят: ник в них мог содержать ':'
+        if len(owner) != 16 or any(ch not in "0123456789abcdef" for ch in owner):
+            return None
+        if time.time() - issued > self.ttl or not nickname:
+            return None
+        return nickname, owner
+    
+    def verify(self, token):
+        """Возвращает ник из действующего токена или None"""
+        verified = self.verify_owner(token)
+        return verified[0] if verified is not None else None
 
 class ChatServer:
-    def __init__(self, host='0.0.0.0', port=5555):
+    def __init__(self, host='0.0.0.0', port=5555, backlog=5,
+                 queue_size=1000, slow_consumer='drop_oldest', history=None, metrics=None,
+                 queue_bytes=MAX_QUEUE_BYTES,
+                 bus=None, reuse_port=False, sessions=None, compress_threshold=COMPRESS_THRESHOLD,
+                 rate_limit=RATE_LIMIT, rate_burst=RATE_BURST, room_rate_limit=ROOM_RATE_LIMIT,
+                 room_burst=ROOM_BURST, max_inbound_bytes=MAX_INBOUND_BYTES, max_inflated=MAX_INFLATED,
+                 ping_interval=PING_INTERVAL, idle_timeout=IDLE_TIMEOUT, tcp_keepalive=TCP_KEEPALIVE,
+                 drain_timeout=DRAIN_TIMEOUT, reconnect_spread=RECONNECT_SPREAD, listen_fd=None,
+                 tls=None, hello_timeout=HELLO_TIMEOUT):
         self.host = host
         self.port = port
-        self.clients = []
-        self.nicknames = []
+        self.backlog = backlog
+        self.queue_size = queue_size
+        self.queue_bytes = queue_bytes
+        self.slow_consumer = slow_consumer
+        self.clients = ClientRegistry()
+        self.rooms = RoomIndex()
+        self.history = history
+        self.roster = Roster()
+        self.commands = {
+            'users': self.command_users,
+            'join': self.command_join,
+            'leave': self.command_leave,
+            'history': self.command_history,
+            'search': self.command_search,
+        }
         self.server_socket = None
         self.running = False
+        self.metrics = metrics or Metrics()
+        self.register_gauges()
+        self.reuse_port = reuse_port
+        # Без ключа сессий каждый вход - новый, как раньше
+        self.sessions = sessions
+        # Кадры длиннее порога сжимаются для клиентов, которые это умеют; 0 - не сжимать
+        self.compress_threshold = compress_threshold
+        # Ограничения частоты: на подключение, на комнату и общий предел входящих байт
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.room_rate_limit = room_rate_limit
+        self.room_burst = room_burst
+        self.room_buckets = {}
+        self.room_buckets_lock = threading.Lock()
+        self.inbound_bucket = make_bucket(max_inbound_bytes)
+        self.max_inflated = max_inflated
+        # Пульс: клиентам, которые его поддерживают, молчание дольше ping_interval
+        # стоит ping, а дольше idle_timeout - отключения
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.tcp_keepalive = tcp_keepalive
+        self.idle_wheel = TimerWheel(idle_timeout) if idle_timeout > 0 else None
+        self.hello_timeout = hello_timeout
+        # Остановка с дренажом: очереди дописываются не дольше drain_timeout, а клиенты
+        # получают подсказку, через сколько переподключаться, размазанную по reconnect_spread
+        self.drain_timeout = drain_timeout
+        self.reconnect_spread = reconnect_spread
+        self.stopped = False
+        # Горячий перезапуск: сокет получен от предыдущего процесса / будет передан следующему
+        self.listen_fd = listen_fd
+        self.restart_requested = False
+        # SSL-контекст или None - обычный TCP
+        self.tls = tls
+        # Шина связывает несколько воркеров: общие комнаты, онлайн и уникальность ников
+        self.bus = bus
+        if bus is not None:
+            bus.subscribe(self.on_bus_message)
+        
+    def register_gauges(self):
+        """Датчики считаются только при запросе статистики, а не на каждом сообщении"""
+        self.metrics.gauge('connections_active', lambda: len(self.clients))
+        self.metrics.gauge('rooms', lambda: len(self.rooms.members))
+        self.metrics.gauge('queue_depth_total', lambda: sum(len(c.queue) for c in self.clients.snapshot()))
+        self.metrics.gauge('queue_depth_max', lambda: max((len(c.queue) for c in self.clients.snapshot()), default=0))
+        self.metrics.gauge('queue_bytes_max', lambda: max((c.queued_bytes for c in self.clients.snapshot()), default=0))
+        self.metrics.gauge('threads', threading.active_count)
+        self.metrics.gauge('heartbeat_tracked', lambda: len(self.idle_wheel or ()))
+        self.metrics.gauge('tls', lambda: self.tls is not None)
+        if self.history is not None:
+            self.metrics.gauge('history_pending', lambda: len(self.history.pending))
+            self.metrics.gauge('history_write_errors', lambda: self.history.write_errors)
+            self.metrics.gauge('history_dropped', lambda: self.history.dropped)
         
     def start_server(self):
         try:
-            # Исправлено: правильное создание сокета
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            print(f"🔄 Попытка запуска сервера на {self.host}:{self.port}")
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)  # Добавлен backlog
+            if self.listen_fd is not None:
+                # Сокет уже слушает: его передал предыдущий процесс при горячем перезапуске,
+                # подключения, пришедшие за время передачи, ждут в очереди ядра
+                self.server_socket = socket.socket(fileno=self.listen_fd)
+                # Флаг O_NONBLOCK общий у копий дескриптора, а asyncio его выставлял
+                self.server_socket.setblocking(True)
+                print(f"♻️  Получен слушающий сокет {self.server_socket.getsockname()} от предыдущего процесса")
+            else:
+                # Исправлено: правильное создание сокета
+                self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                if self.reuse_port:
+                    # Несколько воркеров слушают один порт, ядро раздаёт им подключения
+                    self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                
+                print(f"🔄 Попытка запуска сервера на {self.host}:{self.port}")
+                self.server_socket.bind((self.host, self.port))
+                self.server_socket.listen(self.backlog)
             self.running = True
+            self.install_signal_handlers()
+            self.start_reaper()
+            if self.bus is not None:
+                # Узнаём, кто уже онлайн на других воркерах
+                self.bus.publish("roster_request", {})
             
             print("=" * 50)
             print("🎯 ЧАТ-СЕРВЕР ЗАПУЩЕН")
             print(f"📡 Адрес: {self.host}:{self.port}")
             print(f"🌐 Для подключения извне используйте ваш IP: {self.get_local_ip()}")
             print("⏹️  Для остановки нажмите Ctrl+C")
+            if hasattr(signal, 'SIGUSR2'):
+                print(f"♻️  Перезапуск без разрыва порта: kill -USR2 {os.getpid()}")
             print("=" * 50)
             
             self.accept_connections()
@@ -63,7 +789,10 @@ class ChatServer:
         while self.running:
             try:
                 client_socket, address = self.server_socket.accept()
-                print(f"🔗 Новое подключение от {address}")
+                if self.tcp_keepalive:
+                    enable_keepalive(client_socket, self.tcp_keepalive)
+                self.metrics.inc('connections_total')
+                log.debug("🔗 Новое подключение от %s", address)
                 
                 # Запускаем обработку клиента в отдельном потоке
                 client_thread = threading.Thread(
@@ -77,77 +806,558 @@ class ChatServer:
                 continue
             except Exception as e:
                 if self.running:
-                    print(f"⚠️  Ошибка при принятии подключения: {e}")
+                    log.warning("⚠️  Ошибка при принятии подключения: %s", e)
+    
+    def tls_handshake(self, client_socket, address):
+        """TLS-рукопожатие в потоке клиента: медленные и зависшие клиенты не держат accept"""
+        client_socket.settimeout(TLS_HANDSHAKE_TIMEOUT)
+        try:
+            tls_socket = self.tls.wrap_socket(client_socket, server_side=True)
+        except (OSError, ValueError) as e:
+            self.metrics.inc('tls_failed')
+            log.debug("🔒 TLS-рукопожатие с %s не удалось: %s", address, e)
+            client_socket.close()
+            return None
+        tls_socket.settimeout(None)
+        self.count_tls(tls_socket)
+        return tls_socket
+    
+    def count_tls(self, ssl_object):
+        self.metrics.inc('tls_handshakes')
+        if ssl_object.session_reused:
+            self.metrics.inc('tls_resumed')
     
     def handle_client(self, client_socket, address):
         """Обрабатывает подключение клиента"""
+        if self.tls is not None:
+            client_socket = self.tls_handshake(client_socket, address)
+            if client_socket is None:
+                return
+        connection = ClientConnection(client_socket, address, self.queue_size, self.slow_consumer,
+                                      self.metrics, self.queue_bytes)
         nickname = None
         try:
-            # Запрос ника у клиента
-            client_socket.send("NICK".encode('utf-8'))
-            nickname = client_socket.recv(1024).decode('utf-8').strip()
-            
-            if not nickname:
-                nickname = f"Гость_{address[0]}"
-            
-            # Проверяем уникальность ника
-            original_nickname = nickname
-            counter = 1
-            while nickname in self.nicknames:
-                nickname = f"{original_nickname}_{counter}"
-                counter += 1
-            
-            # Добавляем клиента в списки
-            self.nicknames.append(nickname)
-            self.clients.append(client_socket)
-            
-            print(f"👤 Пользователь {nickname} присоединился к чату")
-            print(f"📊 Сейчас онлайн: {len(self.clients)} пользователей")
+            # Запрос ника у клиента; на ответ - не больше hello_timeout
+            reader = FrameReader(client_socket)
+            client_socket.settimeout(self.hello_timeout)
+            try:
+                client_socket.sendall(encode_frame(NICK_REQUEST))
+                hello = decode_hello(reader.read_frame() or b"")
+            except socket.timeout:
+                self.hello_timed_out(address)
+                return
+            client_socket.settimeout(None)
+            connection.codec = choose_codec(hello, self.compress_threshold)
+            connection.bucket = make_bucket(self.rate_limit, self.rate_burst)
+            connection.heartbeat = bool(hello.get("heartbeat"))
+            resumed = self.resume_session(hello)
+            nickname = self.claim_nickname(resumed or hello["nickname"], address, takeover=bool(resumed))
             
-            # Отправляем приветственное сообщение
-            welcome_msg = {
-                "sender": "SERVER",
-                "message": f"Добро пожаловать в чат, {nickname}!",
-                "timestamp": datetime.now().strftime("%H:%M:%S"),
-                "type": "welcome"
-            }
-            client_socket.send(json.dumps(welcome_msg).encode('utf-8'))
-            
-            # Уведомляем всех о новом пользователе
-            self.broadcast_message(f"{nickname} присоединился к чату!", "SERVER")
+            # Дальше в сокет пишет только поток-писатель подключения (его запускает register_client)
+            nickname = self.register_client(connection, nickname, hello if resumed else None)
             
             # Основной цикл получения сообщений
             while self.running:
                 try:
-                    message = client_socket.recv(1024).decode('utf-8')
-                    if not message:
+                    frame = reader.read_frame()
+                    if frame is None:
+                        connection.close_reason = connection.close_reason or 'closed'
                         break
                     
-                    message_data = json.loads(message)
-                    
-                    if message_data.get('type') == 'message':
-                        print(f"💬 {nickname}: {message_data['content']}")
-                        self.broadcast_message(
-                            message_data['content'], 
-                            nickname
-                        )
+                    connection.last_seen = time.monotonic()
+                    payload = connection.codec.unpack(frame, self.max_inflated)
+                    delay = self.count_inbound(frame, payload)
+                    self.process_message(connection, connection.codec.decode_unpacked(payload))
+                    if delay:
+                        # Общий предел трафика превышен: не читаем сокет, пусть копится у отправителя
+                        time.sleep(delay)
                         
-                except json.JSONDecodeError:
-                    print(f"⚠️  Неверный формат сообщения от {nickname}")
-                except ConnectionResetError:
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    self.metrics.inc('messages_invalid')
+                    log.warning("⚠️  Неверный формат сообщения от %s", nickname)
+                except (ConnectionResetError, ProtocolError) as e:
+                    connection.close_reason = connection.close_reason or (
+                        'protocol' if isinstance(e, ProtocolError) else 'reset')
                     break
                 except Exception as e:
-                    print(f"⚠️  Ошибка с клиентом {nickname}: {e}")
+                    connection.close_reason = connection.close_reason or 'error'
+                    log.warning("⚠️  Ошибка с клиентом %s: %s", nickname, e)
                     break
                     
         except Exception as e:
-            print(f"❌ Ошибка обработки клиента {address}: {e}")
+            connection.close_reason = connection.close_reason or 'error'
+            log.warning("❌ Ошибка обработки клиента %s: %s", address, e)
         finally:
             if nickname:
-                self.remove_client(client_socket, nickname)
+                self.remove_client(connection, nickname)
+            else:
+                connection.close()
+    
+    def hello_timed_out(self, address):
+        self.metrics.inc('hello_timeouts')
+        log.debug("⌛ %s не ответил на NICK за %s с, отключаем", address, self.hello_timeout)
+    
+    def count_inbound(self, frame, payload):
+        """Учитывает входящий кадр; возвращает, на сколько секунд приостановить чтение.
+        payload - кадр после распаковки: предел трафика считается по нему, иначе
+        сжатые кадры проходили бы его в сотни раз быстрее."""
+        size = len(frame) + HEADER_SIZE
+        self.metrics.inc('messages_in')
+        self.metrics.inc('bytes_in', size)
+        if payload is not frame:
+            self.metrics.inc('bytes_in_inflated', len(payload) + HEADER_SIZE)
+            size = max(size, len(payload) + HEADER_SIZE)
+        if self.inbound_bucket is None:
+            return 0
+        delay = self.inbound_bucket.take_or_wait(size)
+        if delay:
+            self.metrics.observe('inbound_paused_seconds', delay)
+        return delay
+    
+    def resume_session(self, hello):
+        """Проверяет токен из рукопожатия; возвращает ник сессии или None.
+        Если старое подключение с этим ником ещё не отвалилось, оно закрывается."""
+        if self.sessions is None:
+            return None
+        nickname = self.sessions.verify(hello.get("session"))
+        if nickname is None:
+            return None
+        stale = self.clients.get(nickname)
+        if stale is not None:
+            stale.close_reason = 'replaced'
+            self.remove_client(stale, nickname)
+        self.metrics.inc('sessions_resumed')
+        return nickname
+    
+    def claim_nickname(self, nickname, address, takeover=False):
+        """Выбирает ник; с шиной - уникальный среди всех воркеров (блокирующий запрос к брокеру).
+        takeover - ник восстановленной сессии: если старое подключение висит на другом
+        воркере, брокер передаёт ник сюда, а тот воркер закрывает старое подключение."""
+        if not nickname:
+            nickname = f"Гость_{address[0]}"
+        if self.bus is not None:
+            nickname = self.bus.claim_nickname(nickname, takeover)
+        return nickname
+    
+    def register_client(self, connection, nickname, resume=None):
+        """Регистрирует клиента после рукопожатия и возвращает итоговый ник.
+        resume - рукопожатие восстановленной сессии: комнаты и id последнего сообщения."""
+        if not self.running:
+            # Рукопожатие закончилось уже во время остановки: вместо входа - подсказка вернуться
+            connection.start(connection.codec.encode(self.shutdown_message()))
+            connection.close()
+            return nickname
+        
+        # Регистрируем клиента; занятый ник получит суффикс _1, _2...
+        nickname = self.clients.add(connection, nickname)
+        connection.nickname = nickname
+        self.rooms.join(connection, DEFAULT_ROOM)
+        
+        log.info("👤 Пользователь %s %s (онлайн: %d)", nickname,
+                 "вернулся в чат" if resume else "присоединился к чату", len(self.clients))
+        
+        # Отправляем приветственное сообщение
+        welcome_msg = {
+            "sender": "SERVER",
+            "message": f"С возвращением, {nickname}!" if resume else f"Добро пожаловать в чат, {nickname}!",
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "type": "welcome",
+            "nickname": nickname,
+            "resumed": resume is not None,
+            "encoding": connection.codec.encoding
+        }
+        if connection.codec.compression:
+            welcome_msg["compression"] = connection.codec.compression
+        owner = self.bind_owner(nickname, resume)
+        if owner is not None:
+            welcome_msg["session"] = self.sessions.issue(nickname, owner)
+        if connection.heartbeat and self.idle_wheel is not None:
+            # Клиент по этому интервалу поймёт, что сервер пропал
+            welcome_msg["ping_interval"] = self.ping_interval
+            self.idle_wheel.schedule(connection, self.ping_interval)
+        # Подключение уже видно рассылкам, но писатель запускается только сейчас:
+        # приветствие уходит первым, раньше кадров, что успели встать в очередь
+        connection.start(encode_message(welcome_msg))
+        if self.sessions is not None and owner is None:
+            self.send_info(connection, f"Ник {nickname} закреплён за другим пользователем: "
+                                       "сессия не выдана, его личные сообщения вам не придут")
+        if resume is not None:
+            self.restore_session(connection, resume)
+        # Личные сообщения отдаются только владельцу ника
+        if self.history is not None and owner is not None:
+            self.reply_from_history(connection, self.load_offline, nickname)
+        
+        # Уведомляем всех о новом пользователе
+        self.roster.add(nickname)
+        self.broadcast_presence("join", nickname)
+        if self.bus is not None:
+            self.bus.publish("presence", {"event": "join", "nickname": nickname})
+        if resume is not None:
+            self.broadcast_message(f"{nickname} вернулся в чат", "SERVER")
+        else:
+            self.broadcast_message(f"{nickname} присоединился к чату!", "SERVER")
+        return nickname
+    
+    def bind_owner(self, nickname, resume):
+        """Владелец ника для нового токена; None - токен не выдаётся.
+        
+        Ник закрепляется за первым, кто его занял: дальше токен (а с ним и ящик личных
+        сообщений) получает только тот, кто предъявил токен этого же владельца. Иначе
+        назвавшийся чужим ником, пока хозяина нет, получил бы токен и с ним почту.
+        Без истории ящиков нет, и закреплять нечего.
+        """
+        if self.sessions is None:
+            return None
+        verified = self.sessions.verify_owner(resume.get("session")) if resume is not None else None
+        owner = verified[1] if verified is not None and verified[0] == nickname else None
+        if self.history is None:
+            return owner or new_owner()
+        # Короткая запись по ключу, в потоке клиента (в asyncio - в цикле событий)
+        return self.history.bind_nickname(nickname, owner, self.sessions.ttl)
+    
+    def restore_session(self, connection, resume):
+        """Возвращает клиента в его комнаты и досылает сообщения после last_id"""
+        rooms = resume.get("rooms")
+        for room in rooms if isinstance(rooms, list) else []:
+            room = normalize_room(room)
+            if room is not None:
+                self.rooms.join(connection, room)
+        
+        try:
+            last_id = int(resume.get("last_id"))
+        except (TypeError, ValueError):
+            return
+        if self.history is None:
+            return
+        for room in self.rooms.rooms_of(connection):
+            self.send_history(connection, room, {"since": last_id, "limit": MAX_PAGE_SIZE, "replay": True})
+    
+    def process_message(self, connection, message_data):
+        """Обрабатывает одно сообщение, пришедшее от клиента"""
+        if message_data.get('type') == 'pong':
+            # Ответ на пульс; время активности уже обновлено при чтении кадра
+            return
+        if message_data.get('type') == 'ping':
+            # Клиент проверяет, жив ли сервер
+            connection.send(PONG_FRAME)
+            return
+        if connection.bucket is not None:
+            retry_after = connection.bucket.try_take()
+            if retry_after:
+                # Отказ в команде помечаем ею же, чтобы клиент не ждал ответа на неё
+                extra = {"command": message_data.get('command')} if message_data.get('type') == 'command' else {}
+                self.reject_rate_limited(connection, 'connection', retry_after, **extra)
+                return
+        
+        msg_type = message_data.get('type')
+        if msg_type == 'message':
+            if not isinstance(message_data.get('content'), str):
+                # Не сохраняем и не рассылаем: кодеки ждут текст
+                self.metrics.inc('messages_invalid')
+                self.send_info(connection, "Сообщение должно быть текстом")
+                return
+            room = normalize_room(message_data.get('room', DEFAULT_ROOM))
+            if room is None or not self.rooms.is_member(connection, room):
+                self.send_info(connection, f"Вы не состоите в комнате #{message_data.get('room')}")
+                return
+            bucket = self.room_bucket(room)
+            retry_after = bucket.try_take() if bucket is not None else 0
+            if retry_after:
+                self.reject_rate_limited(connection, 'room', retry_after, room=room)
+                return
+            log.debug("💬 [%s] %s: %s", room, connection.nickname, message_data['content'])
+            self.broadcast_message(
+                message_data['content'], 
+                connection.nickname,
+                room,
+                persist=True
+            )
+        elif msg_type == 'private':
+            self.send_private(connection, message_data)
+        elif msg_type == 'command':
+            self.handle_command(connection, message_data)
+    
+    def send_private(self, connection, message_data):
+        """Личное сообщение: получатель находится по индексу ников за O(1), сколько бы
+        людей ни было онлайн; кого нет в сети, тому сообщение ждёт в ящике до входа"""
+        recipient = str(message_data.get('recipient') or '').strip()
+        content = message_data.get('content')
+        if not recipient or not isinstance(content, str) or not content.strip():
+            self.send_info(connection, "Использование: /msg <ник> <текст>")
+            return
+        if recipient == connection.nickname:
+            self.send_info(connection, "Нельзя написать личное сообщение самому себе")
+            return
+        
+        private_msg = {
+            "sender": connection.nickname,
+            "recipient": recipient,
+            "message": content,
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "type": "private"
+        }
+        log.debug("✉️  %s -> %s: %s", connection.nickname, recipient, content)
+        self.metrics.inc('private_messages')
+        target = self.clients.get(recipient)
+        if target is not None:
+            data = encode_message(private_msg)
+            self.send_to_all(data, (target,))
+        elif self.bus is not None and recipient in self.roster:
+            # Получатель на другом воркере - его воркер найдёт подключение по своему индексу
+            self.bus.publish("private", private_msg)
+            data = encode_message(private_msg)
+        elif self.history is not None and self.sessions is not None:
+            origin = connection.address[0] if connection.address else ""
+            self.reply_from_history(connection, self.store_private, private_msg, origin)
+            return
+        else:
+            # Без токенов сессий не узнать, что зашёл именно владелец ника, - ящик не ведём
+            self.send_info(connection, f"{recipient} не в сети, а ящика для личных сообщений на сервере нет")
+            return
+        # Копия отправителю: так он видит, что сообщение ушло
+        connection.send(data)
+    
+    def store_private(self, private_msg, origin):
+        """Кладёт сообщение в ящик получателя; возвращает ответ отправителю.
+        Ящик есть только у ника с владельцем, иначе почту забрал бы первый назвавшийся."""
+        if not self.history.is_bound(private_msg["recipient"]):
+            return self.error_message('no_mailbox', f"{private_msg['recipient']} не в сети, "
+                                      "и ящика для личных сообщений у этого ника нет")
+        refused = self.history.queue_private(private_msg["recipient"], private_msg["sender"],
+                                             private_msg["message"], private_msg["timestamp"], origin)
+        if refused == 'mailbox_full':
+            return self.error_message(refused, f"У {private_msg['recipient']} слишком много "
+                                      "непрочитанных сообщений, попробуйте позже")
+        if refused == 'sender_limit':
+            return self.error_message(refused, "С вашего адреса слишком много сообщений ждёт "
+                                      "получателей не в сети, попробуйте позже")
+        if refused is not None:
+            return self.error_message(refused, "Ящики личных сообщений на сервере переполнены, попробуйте позже")
+        self.metrics.inc('private_offline')
+        return dict(private_msg, offline=True)
+    
+    def load_offline(self, nickname):
+        """Сообщения, пришедшие, пока клиента не было; None - ничего не ждёт"""
+        messages = self.history.take_private(nickname)
+        if not messages:
+            return None
+        return {"type": "offline", "messages": messages}
+    
+    def start_reaper(self):
+        """Фоновый поток, который раз в тик проверяет колесо молчащих подключений"""
+        if self.idle_wheel is None:
+            return
+        
+        def reaper_loop():
+            while self.running:
+                time.sleep(self.idle_wheel.tick)
+                self.reap_idle()
+        
+        threading.Thread(target=reaper_loop, daemon=True).start()
     
-    def broadcast_message(self, message, sender="SERVER"):
-        """Отправляет сообщение всем клиентам"""
+    def reap_idle(self):
+        """Один тик пульса: молчащим давно - ping, молчащим слишком долго - отключение"""
+        now = time.monotonic()
+        for connection in self.idle_wheel.advance():
+            if connection.closed:
+                continue
+            idle = now - connection.last_seen
+            if idle >= self.idle_timeout:
+                log.info("💤 %s не отвечает %.0f с, отключаем", connection.nickname, idle)
+                connection.close_reason = 'idle'
+                connection.abort()
+                self.remove_client(connection, connection.nickname)
+            elif idle >= self.ping_interval:
+                connection.send(PING_FRAME)
+                self.metrics.inc('pings_sent')
+                self.idle_wheel.schedule(connection, self.idle_timeout - idle)
+            else:
+                self.idle_wheel.schedule(connection, self.ping_interval - idle)
+    
+    def room_bucket(self, room):
+        """Ведро токенов комнаты, общее для всех её участников в этом процессе"""
+        if self.room_rate_limit <= 0:
+            return None
+        bucket = self.room_buckets.get(room)
+        if bucket is None:
+            with self.room_buckets_lock:
+                bucket = self.room_buckets.setdefault(
+                    room, TokenBucket(self.room_rate_limit, self.room_burst))
+        return bucket
+    
+    def forget_empty_rooms(self, rooms):
+        """Убирает вёдра комнат, в которых больше никого нет"""
+        with self.room_buckets_lock:
+            for room in rooms:
+                if room not in self.rooms.members:
+                    self.room_buckets.pop(room, None)
+    
+    def reject_rate_limited(self, connection, scope, retry_after, **extra):
+        """Отвечает ошибкой на сообщение сверх лимита; само сообщение отбрасывается"""
+        self.metrics.inc(f'rate_limited.{scope}')
+        if scope == 'room':
+            text = f"Слишком много сообщений в #{extra.get('room')}, подождите {retry_after:.1f} с"
+        else:
+            text = f"Вы отправляете сообщения слишком часто, подождите {retry_after:.1f} с"
+        self.send_error(connection, 'rate_limited', text, retry_after=round(retry_after, 2), **extra)
+    
+    def send_error(self, connection, code, message, **extra):
+        """Отправляет клиенту ошибку: type "error", машинный code и текст для показа"""
+        connection.send(encode_message(self.error_message(code, message, **extra)))
+    
+    @staticmethod
+    def error_message(code, message, **extra):
+        error_msg = {
+            "sender": "SERVER",
+            "message": message,
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "type": "error",
+            "code": code
+        }
+        error_msg.update(extra)
+        return error_msg
+    
+    def handle_command(self, connection, message_data):
+        """Находит обработчик команды клиента в таблице self.commands"""
+        handler = self.commands.get(message_data.get('command'))
+        if handler is None:
+            self.send_info(connection, f"Неизвестная команда: {message_data.get('command')}")
+            return
+        handler(connection, message_data)
+    
+    def command_users(self, connection, message_data):
+        """Отправляет готовый сериализованный список пользователей"""
+        connection.send(self.roster.frame())
+    
+    def command_join(self, connection, message_data):
+        room = normalize_room(message_data.get('room'))
+        if room is None:
+            self.send_info(connection, "Некорректное название комнаты", command="join")
+        else:
+            self.join_room(connection, room)
+    
+    def command_leave(self, connection, message_data):
+        room = normalize_room(message_data.get('room'))
+        if room is None:
+            self.send_info(connection, "Некорректное название комнаты", command="leave")
+        else:
+            self.leave_room(connection, room)
+    
+    def command_history(self, connection, message_data):
+        room = normalize_room(message_data.get('room', DEFAULT_ROOM))
+        if self.history is None:
+            self.send_info(connection, "История сообщений на сервере отключена")
+            return
+        if room is None or not self.rooms.is_member(connection, room):
+            self.send_info(connection, f"Вы не состоите в комнате #{message_data.get('room')}")
+            return
+        try:
+            request = {key: int(message_data[key]) for key in ('limit', 'before', 'since')
+                       if message_data.get(key) is not None}
+        except (TypeError, ValueError):
+            self.send_info(connection, "Некорректный запрос истории")
+            return
+        if message_data.get('replay'):
+            request['replay'] = True
+        self.send_history(connection, room, request)
+    
+    def command_search(self, connection, message_data):
+        """Поиск по истории комнат клиента; in:комната сужает поиск до одной из них"""
+        if self.history is None or not self.history.searchable:
+            self.send_info(connection, "Поиск по истории на сервере недоступен")
+            return
+        words = []
+        rooms = self.rooms.rooms_of(connection)
+        for word in str(message_data.get('query') or '').split():
+            if word.lower().startswith('in:'):
+                room = normalize_room(word[len('in:'):])
+                if room not in rooms:
+                    self.send_info(connection, f"Вы не состоите в комнате #{word[len('in:'):]}")
+                    return
+                rooms = {room}
+            else:
+                words.append(word)
+        try:
+            request = {key: int(message_data[key]) for key in ('limit', 'before')
+                       if message_data.get(key) is not None}
+        except (TypeError, ValueError):
+            self.send_info(connection, "Некорректный запрос поиска")
+            return
+        request['query'] = message_data.get('query')
+        self.reply_from_history(connection, self.load_search, " ".join(words), rooms, request)
+    
+    def load_search(self, text, rooms, request):
+        results, more = self.history.search(text, rooms, limit=request.get('limit', PAGE_SIZE),
+                                            before=request.get('before'))
+        return {
+            "type": "search",
+            "query": request['query'],
+            "results": results,
+            "more": more
+        }
+    
+    def send_history(self, connection, room, request):
+        """Отправляет клиенту страницу истории комнаты"""
+        self.reply_from_history(connection, self.load_history, room, request)
+    
+    def reply_from_history(self, connection, load, *args):
+        """Отправляет клиенту результат обращения к базе (в потоке этого клиента); None - не отвечать"""
+        reply = load(*args)
+        if reply is not None:
+            connection.send(connection.codec.encode(reply))
+    
+    def load_history(self, room, request):
+        """Читает страницу истории: последние limit сообщений, до before или после since"""
+        messages, more = self.history.fetch(
+            room,
+            limit=request.get('limit', PAGE_SIZE),
+            before=request.get('before'),
+            since=request.get('since')
+        )
+        history_msg = {
+            "type": "history",
+            "room": room,
+            "messages": messages,
+            "more": more
+        }
+        if request.get('replay'):
+            # Пропущенные за время обрыва сообщения клиент показывает как обычные
+            history_msg["replay"] = True
+        return history_msg
+    
+    def join_room(self, connection, room):
+        # На каждый join/leave ровно один ответ с полем command: клиент по нему знает,
+        # что смена комнаты обработана, даже если она не удалась
+        if not self.rooms.join(connection, room):
+            self.send_info(connection, f"Вы уже в комнате #{room}", command="join")
+            return
+        self.send_info(connection, f"Вы вошли в комнату #{room}", room=room, event="joined", command="join")
+        self.broadcast_message(f"{connection.nickname} вошёл в комнату", "SERVER", room)
+    
+    def leave_room(self, connection, room):
+        if room == DEFAULT_ROOM:
+            self.send_info(connection, f"Из комнаты #{DEFAULT_ROOM} выйти нельзя", command="leave")
+            return
+        if not self.rooms.leave(connection, room):
+            self.send_info(connection, f"Вы не состоите в комнате #{room}", command="leave")
+            return
+        self.send_info(connection, f"Вы вышли из комнаты #{room}", room=room, event="left", command="leave")
+        self.broadcast_message(f"{connection.nickname} вышел из комнаты", "SERVER", room)
+        self.forget_empty_rooms((room,))
+    
+    def send_info(self, connection, message, **extra):
+        """Отправляет служебное сообщение одному клиенту"""
+        info_msg = {
+            "sender": "SERVER",
+            "message": message,
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "type": "info"
+        }
+        info_msg.update(extra)
+        connection.send(encode_message(info_msg))
+    
+    def broadcast_message(self, message, sender="SERVER", room=None, persist=False):
+        """Отправляет сообщение участникам комнаты, а без комнаты - всем клиентам"""
         timestamp = datetime.now().strftime("%H:%M:%S")
         message_data = {
             "sender": sender,
@@ -155,83 +1365,569 @@ class ChatServer:
             "timestamp": timestamp,
             "type": "message"
         }
+        if room is not None:
+            message_data["room"] = room
+            if persist and self.history is not None:
+                message_data["id"] = self.history.append(room, sender, message, timestamp)
         
+        self.fan_out(message_data, room)
+        if self.bus is not None:
+            self.bus.publish("message", message_data)
+    
+    def fan_out(self, message_data, room=None):
+        """Доставляет сообщение подключениям этого процесса"""
+        # Сериализуем один раз на кодировку и раздаём одни и те же байты всем очередям
+        started = time.perf_counter()
+        self.send_to_all(EncodedMessage(message_data), None if room is None else self.rooms.snapshot(room))
+        self.metrics.observe('broadcast_seconds', time.perf_counter() - started)
+        self.metrics.inc('broadcasts')
+    
+    def broadcast_presence(self, event, nickname):
+        """Рассылает изменение списка онлайн, чтобы клиентам не нужно было запрашивать его целиком"""
+        self.send_to_all(encode_message({
+            "type": "presence",
+            "event": event,
+            "nickname": nickname,
+            "count": len(self.roster)
+        }))
+    
+    def on_bus_message(self, topic, payload):
+        """Сообщение от другого воркера; вызывается в потоке шины"""
+        self.call_in_server(self.handle_bus_message, topic, payload)
+    
+    def call_in_server(self, function, *args):
+        """Выполняет функцию там, где сервер обрабатывает клиентов (здесь - сразу, всё потокобезопасно)"""
+        function(*args)
+    
+    def handle_bus_message(self, topic, payload):
+        if topic == "message":
+            # У каждого узла может быть своя база: сохраняем чужое сообщение под его id,
+            # чтобы история, поиск и досылка видели всю комнату
+            if self.history is not None and payload.get("id") is not None and payload.get("room"):
+                self.history.store(payload["id"], payload["room"], payload.get("sender", ""),
+                                   payload.get("message", ""), payload.get("timestamp", ""))
+            self.fan_out(payload, payload.get("room"))
+        elif topic == "presence":
+            nickname = payload["nickname"]
+            if payload["event"] == "join":
+                self.roster.add(nickname)
+            else:
+                self.roster.remove(nickname)
+            self.broadcast_presence(payload["event"], nickname)
+        elif topic == "takeover":
+            # Владелец ника вернулся через другой воркер: старое подключение закрываем молча,
+            # для остальных он не выходил из чата
+            stale = self.clients.get(payload["nickname"])
+            if stale is not None:
+                stale.close_reason = 'replaced'
+                self.remove_client(stale, payload["nickname"], announce=False)
+        elif topic == "private":
+            target = self.clients.get(payload["recipient"])
+            if target is not None:
+                self.send_to_all(encode_message(payload), (target,))
+        elif topic == "roster_request":
+            self.bus.publish("roster", {"nicknames": self.clients.nicknames()})
+        elif topic == "reconnected":
+            # Брокер вернулся: другие воркеры могли пропустить наших клиентов, а мы - их
+            self.bus.publish("roster", {"nicknames": self.clients.nicknames()})
+            self.bus.publish("roster_request", {})
+        elif topic == "roster":
+            for nickname in payload["nicknames"]:
+                self.roster.add(nickname)
+    
+    def send_to_all(self, data, recipients=None):
+        """Кладёт кадр в очереди получателей (по умолчанию всех) и убирает отвалившихся.
+        data - готовые байты (JSON понимают все) или EncodedMessage для кадра в кодировке получателя."""
+        if recipients is None:
+            recipients = self.clients.snapshot()
         disconnected_clients = []
-        for client in self.clients:
-            try:
-                client.send(json.dumps(message_data).encode('utf-8'))
-            except:
-                disconnected_clients.append(client)
+        if isinstance(data, EncodedMessage):
+            for client in recipients:
+                if not client.send(data.frame(client.codec)):
+                    disconnected_clients.append(client)
+        else:
+            for client in recipients:
+                if not client.send(data):
+                    disconnected_clients.append(client)
         
         # Удаляем отключившихся клиентов
         for client in disconnected_clients:
-            index = self.clients.index(client)
-            nick = self.nicknames[index]
-            self.remove_client(client, nick)
-    
-    def remove_client(self, client_socket, nickname):
-        """Удаляет клиента из списков"""
-        if client_socket in self.clients:
-            index = self.clients.index(client_socket)
-            self.clients.remove(client_socket)
-            self.nicknames.remove(nickname)
-            
-            print(f"👋 Пользователь {nickname} покинул чат")
-            print(f"📊 Осталось онлайн: {len(self.clients)} пользователей")
-            
-            if self.running:
-                self.broadcast_message(f"{nickname} покинул чат", "SERVER")
-            
-            try:
-                client_socket.close()
-            except:
-                pass
+            self.remove_client(client, client.nickname)
     
-    def stop_server(self):
-        """Останавливает сервер"""
-        self.running = False
-        print("\n🛑 Остановка сервера...")
+    def remove_client(self, connection, nickname, announce=True):
+        """Удаляет клиента из реестра; подключение закрывается, что бы ни случилось по дороге.
+        announce=False - ник уже перешёл к подключению на другом воркере: из списка онлайн
+        его не убираем и об уходе никому не сообщаем."""
+        try:
+            if self.idle_wheel is not None:
+                self.idle_wheel.discard(connection)
+            self.forget_empty_rooms(self.rooms.leave_all(connection))
+            if self.clients.remove(connection) is not None:
+                reason = connection.close_reason or 'closed'
+                self.metrics.inc(f'disconnects.{reason}')
+                log.info("👋 Пользователь %s покинул чат (%s, онлайн: %d)", nickname, reason, len(self.clients))
+                
+                if connection.dropped:
+                    log.warning("🐢 %s: отброшено %d сообщений из-за медленного чтения", nickname, connection.dropped)
+                
+                if not announce:
+                    return
+                self.roster.remove(nickname)
+                if self.bus is not None:
+                    self.bus.release_nickname(nickname)
+                if self.running:
+                    self.broadcast_presence("leave", nickname)
+                    if self.bus is not None:
+                        self.bus.publish("presence", {"event": "leave", "nickname": nickname})
+                    self.broadcast_message(f"{nickname} покинул чат", "SERVER")
+        finally:
+            connection.close()
+    
+    def install_signal_handlers(self):
+        """SIGTERM - остановка с дренажом, как Ctrl+C; SIGUSR2 - горячий перезапуск"""
+        if threading.current_thread() is not threading.main_thread():
+            return
+        
+        def on_terminate(signum, frame):
+            raise KeyboardInterrupt
         
-        # Отправляем сообщение о закрытии
-        shutdown_msg = {
+        def on_restart(signum, frame):
+            self.restart_requested = True
+            raise KeyboardInterrupt
+        
+        signal.signal(signal.SIGTERM, on_terminate)
+        if hasattr(signal, 'SIGUSR2'):
+            signal.signal(signal.SIGUSR2, on_restart)
+    
+    def shutdown_message(self):
+        """Уведомление о закрытии с подсказкой, когда переподключаться.
+        
+        Задержка у каждого клиента своя, чтобы после перезапуска они не пришли разом;
+        пропущенное за это время клиент догонит из истории при восстановлении сессии.
+        """
+        restart = self.restart_requested
+        return {
             "sender": "SERVER",
-            "message": "Сервер останавливается...",
+            "message": "Сервер перезапускается..." if restart else "Сервер останавливается...",
             "timestamp": datetime.now().strftime("%H:%M:%S"),
-            "type": "shutdown"
+            "type": "shutdown",
+            "restart": restart,
+            "reconnect_in": round(random.uniform(0.5, max(0.5, self.reconnect_spread)), 2)
         }
+    
+    def drain_clients(self):
+        """Уведомляет клиентов и ждёт, пока их очереди уйдут в сеть, но не дольше drain_timeout"""
+        clients = self.clients.snapshot()
+        for client in clients:
+            client.send(client.codec.encode(self.shutdown_message()))
+            client.close()
         
-        for client in self.clients:
-            try:
-                client.send(json.dumps(shutdown_msg).encode('utf-8'))
-                client.close()
-            except:
-                pass
+        deadline = time.monotonic() + self.drain_timeout
+        for client in clients:
+            client.writer_thread.join(max(0, deadline - time.monotonic()))
         
+        stuck = [client for client in clients if client.writer_thread.is_alive()]
+        for client in stuck:
+            client.abort()
+        return len(clients), len(stuck)
+    
+    def handoff_socket(self):
+        """Копия слушающего сокета для следующего процесса: очередь accept не закрывается"""
+        handoff_fd = os.dup(self.server_socket.fileno())
+        os.set_inheritable(handoff_fd, True)
+        return handoff_fd
+    
+    def spawn_successor(self, handoff_fd):
+        """Запускает новый процесс сервера с теми же аргументами на переданном сокете"""
+        command = [sys.executable, os.path.abspath(sys.argv[0])]
+        command += without_option(sys.argv[1:], LISTEN_FD_OPTION) + [LISTEN_FD_OPTION, str(handoff_fd)]
+        successor = subprocess.Popen(command, pass_fds=(handoff_fd,), start_new_session=True)
+        os.close(handoff_fd)
+        print(f"♻️  Новый процесс сервера: PID {successor.pid}")
+        return successor
+    
+    def stop_server(self):
+        """Останавливает сервер: перестаёт принимать подключения и дренирует клиентов"""
+        if self.stopped:
+            return
+        self.stopped = True
+        self.running = False
+        print("\n🛑 Остановка сервера...")
+        
+        # Сначала перестаём принимать подключения; при перезапуске сокет остаётся жить в копии
+        handoff_fd = None
         if self.server_socket:
+            if self.restart_requested:
+                handoff_fd = self.handoff_socket()
             self.server_socket.close()
         
+        started = time.monotonic()
+        total, stuck = self.drain_clients()
+        if total:
+            log.info("📤 Клиентов уведомлено: %d за %.2f с, оборвано по таймауту: %d",
+                     total, time.monotonic() - started, stuck)
+        self.clients.clear()
+        
+        # История дописывается до запуска преемника, чтобы он продолжил нумерацию с неё
+        if self.history is not None:
+            self.history.close()
+        
+        if self.bus is not None:
+            self.bus.close()
+        
+        if handoff_fd is not None:
+            self.spawn_successor(handoff_fd)
+        
         print("✅ Сервер остановлен")
 
+class AsyncChatServer(ChatServer):
+    """Сервер на asyncio: все подключения обслуживает один поток с циклом событий"""
+    
+    def __init__(self, host='0.0.0.0', port=5555, backlog=1024, **options):
+        super().__init__(host, port, backlog, **options)
+        self.loop = None
+        self.stop_event = None
+        self.handoff_fd = None
+        # Задачи-обработчики подключений, в том числе ещё не закончившие рукопожатие
+        self.handlers = set()
+    
+    def accept_connections(self):
+        """Запускает цикл событий вместо потока на каждого клиента"""
+        asyncio.run(self.serve())
+    
+    def start_reaper(self):
+        """Проверка пульса запускается задачей в цикле событий (см. serve)"""
+    
+    async def reaper_loop(self):
+        while self.running:
+            await asyncio.sleep(self.idle_wheel.tick)
+            self.reap_idle()
+    
+    def install_signal_handlers(self):
+        """Сигналы обрабатывает цикл событий (см. serve)"""
+    
+    def request_stop(self, restart=False):
+        self.restart_requested = restart
+        self.stop_event.set()
+    
+    async def serve(self):
+        """Принимает подключения на уже открытом сокете"""
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, 'SIGUSR2'):
+            self.loop.add_signal_handler(signal.SIGTERM, self.request_stop)
+            self.loop.add_signal_handler(signal.SIGUSR2, self.request_stop, True)
+        if self.idle_wheel is not None:
+            self.loop.create_task(self.reaper_loop())
+        # С TLS рукопожатие ведёт транспорт asyncio, не блокируя приём и чужой трафик
+        server = await asyncio.start_server(
+            self.handle_connection,
+            sock=self.server_socket,
+            backlog=self.backlog,
+            ssl=self.tls,
+            ssl_handshake_timeout=TLS_HANDSHAKE_TIMEOUT if self.tls is not None else None
+        )
+        # При перезапуске asyncio закроет свой сокет, а очередь accept сохранит копия
+        handoff_fd = None
+        try:
+            await self.stop_event.wait()
+            if self.restart_requested:
+                handoff_fd = self.handoff_socket()
+        finally:
+            # Больше не принимаем: новые подключения дождутся преемника в очереди ядра
+            server.close()
+            # Дренаж идёт, пока цикл событий ещё жив
+            self.running = False
+            await self.drain_clients_async()
+        if handoff_fd is not None:
+            self.handoff_fd = handoff_fd
+    
+    async def handle_connection(self, reader, writer):
+        """Обрабатывает подключение клиента (корутина)"""
+        address = writer.get_extra_info('peername')
+        if self.tcp_keepalive:
+            enable_keepalive(writer.get_extra_info('socket'), self.tcp_keepalive)
+        if self.tls is not None:
+            self.count_tls(writer.get_extra_info('ssl_object'))
+        self.metrics.inc('connections_total')
+        log.debug("🔗 Новое подключение от %s", address)
+        connection = AsyncClientConnection(writer, address, self.queue_size, self.slow_consumer,
+                                           self.metrics, self.queue_bytes)
+        nickname = None
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        try:
+            # Запрос ника у клиента; на ответ - не больше hello_timeout
+            frames = AsyncFrameReader(reader)
+            try:
+                hello = await asyncio.wait_for(self.request_hello(writer, frames), self.hello_timeout)
+            except asyncio.TimeoutError:
+                self.hello_timed_out(address)
+                return
+            connection.codec = choose_codec(hello, self.compress_threshold)
+            connection.bucket = make_bucket(self.rate_limit, self.rate_burst)
+            connection.heartbeat = bool(hello.get("heartbeat"))
+            resumed = self.resume_session(hello)
+            nickname = resumed or hello["nickname"]
+            if self.bus is not None:
+                # Запрос к брокеру блокирующий - уводим его из цикла событий
+                nickname = await self.loop.run_in_executor(None, self.claim_nickname, nickname, address,
+                                                           bool(resumed))
+            else:
+                nickname = self.claim_nickname(nickname, address)
+            
+            nickname = self.register_client(connection, nickname, hello if resumed else None)
+            
+            while self.running:
+                try:
+                    frame = await frames.read_frame()
+                    if frame is None:
+                        connection.close_reason = connection.close_reason or 'closed'
+                        break
+                    
+                    connection.last_seen = time.monotonic()
+                    payload = connection.codec.unpack(frame, self.max_inflated)
+                    delay = self.count_inbound(frame, payload)
+                    self.process_message(connection, connection.codec.decode_unpacked(payload))
+                    if delay:
+                        # Общий предел трафика превышен: не читаем сокет, пусть копится у отправителя
+                        await asyncio.sleep(delay)
+                        
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    self.metrics.inc('messages_invalid')
+                    log.warning("⚠️  Неверный формат сообщения от %s", nickname)
+                except (ConnectionResetError, ProtocolError) as e:
+                    connection.close_reason = connection.close_reason or (
+                        'protocol' if isinstance(e, ProtocolError) else 'reset')
+                    break
+                    
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            connection.close_reason = connection.close_reason or 'error'
+            log.warning("❌ Ошибка обработки клиента %s: %s", address, e)
+        finally:
+            self.handlers.discard(handler)
+            if nickname:
+                self.remove_client(connection, nickname)
+            else:
+                connection.close()
+    
+    async def request_hello(self, writer, frames):
+        writer.write(encode_frame(NICK_REQUEST))
+        await writer.drain()
+        return decode_hello(await frames.read_frame() or b"")
+    
+    def call_in_server(self, function, *args):
+        """Переносит вызов из потока шины в цикл событий"""
+        if self.loop is None:
+            # Цикл ещё не запущен, клиентов нет - достаточно обновить общие структуры
+            function(*args)
+        else:
+            self.loop.call_soon_threadsafe(function, *args)
+    
+    def reply_from_history(self, connection, load, *args):
+        """Читает историю (страницу или результаты поиска) в пуле потоков,
+        чтобы не останавливать цикл событий"""
+        future = self.loop.run_in_executor(None, load, *args)
+        
+        def deliver(done):
+            try:
+                reply = done.result()
+                if reply is not None:
+                    connection.send(connection.codec.encode(reply))
+            except Exception as e:
+                log.warning("⚠️  Ошибка чтения истории для %s: %s", connection.nickname, e)
+        
+        future.add_done_callback(deliver)
+    
+    async def drain_clients_async(self):
+        """Уведомляет клиентов и ждёт задачи-писатели не дольше drain_timeout.
+        
+        Ждём и обработчики: подключение, принятое перед остановкой, доходит до конца
+        рукопожатия и получает подсказку переподключиться, а не обрыв.
+        """
+        clients = self.clients.snapshot()
+        started = time.monotonic()
+        for client in clients:
+            client.send(client.codec.encode(self.shutdown_message()))
+            client.close()
+        
+        writers = [client.writer_task for client in clients if client.writer_task is not None]
+        pending = writers + list(self.handlers)
+        if pending:
+            await asyncio.wait(pending, timeout=self.drain_timeout)
+        
+        stuck = [client for client in clients if client.writer_task is not None and not client.writer_task.done()]
+        for client in stuck:
+            client.abort()
+        if clients:
+            log.info("📤 Клиентов уведомлено: %d за %.2f с, оборвано по таймауту: %d",
+                     len(clients), time.monotonic() - started, len(stuck))
+        self.clients.clear()
+    
+    def drain_clients(self):
+        """Клиентов уже дренировал цикл событий перед выходом из serve"""
+        return 0, 0
+    
+    def handoff_socket(self):
+        if self.handoff_fd is not None:
+            # Копию сделал serve до того, как asyncio закрыл сокет
+            handoff_fd, self.handoff_fd = self.handoff_fd, None
+            return handoff_fd
+        return super().handoff_socket()
+
 def check_port_availability(port):
     """Проверяет доступность порта"""
     try:
         test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Как и у самого сервера: соединения в TIME_WAIT после перезапуска порт не занимают
+        test_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         test_socket.bind(('localhost', port))
         test_socket.close()
         return True
     except:
         return False
 
+def without_option(argv, option):
+    """Убирает из аргументов командной строки опцию со значением"""
+    result = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == option:
+            skip = True
+        elif not arg.startswith(option + '='):
+            result.append(arg)
+    return result
+
+def run_workers(args):
+    """Запускает брокер шины и несколько процессов-воркеров на одном порту (SO_REUSEPORT)"""
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        print("❌ --workers требует SO_REUSEPORT (Linux/BSD/macOS)")
+        return
+    
+    if hasattr(socket, 'AF_UNIX'):
+        bus_address = f"unix:{os.path.join(tempfile.mkdtemp(prefix='chat-bus-'), 'bus.sock')}"
+    else:
+        bus_address = "127.0.0.1:5560"
+    broker = BusBroker(bus_address)
+    broker.start()
+    print(f"🚌 Брокер шины: {bus_address}, воркеров: {args.workers}")
+    
+    if not args.no_sessions:
+        # Создаём ключ до запуска воркеров, чтобы они не создали разные
+        load_session_key(args.session_key)
+    
+    worker_args = without_option(sys.argv[1:], '--workers')
+    workers = []
+    for index in range(1, args.workers + 1):
+        command = [sys.executable, os.path.abspath(__file__)] + worker_args + [
+            '--bus', bus_address, '--reuse-port', '--node-id', str(index)]
+        workers.append(subprocess.Popen(command))
+    
+    try:
+        for worker in workers:
+            worker.wait()
+    except KeyboardInterrupt:
+        print("\n🛑 Остановка воркеров...")
+        for worker in workers:
+            if worker.poll() is None:
+                worker.send_signal(signal.SIGINT)
+        for worker in workers:
+            try:
+                worker.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                pass
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+        broker.stop()
+
 def main():
     parser = argparse.ArgumentParser(description='Чат-сервер')
     parser.add_argument('--host', default='0.0.0.0', help='Хост (по умолчанию: 0.0.0.0)')
     parser.add_argument('--port', type=int, default=5555, help='Порт (по умолчанию: 5555)')
     parser.add_argument('--check-port', action='store_true', help='Проверить доступность порта')
+    parser.add_argument('--mode', choices=['threads', 'asyncio'], default='threads',
+                        help='Режим работы: поток на клиента или один цикл asyncio (по умолчанию: threads)')
+    parser.add_argument('--backlog', type=int, default=None,
+                        help='Длина очереди входящих подключений (по умолчанию: 5 для threads, 1024 для asyncio)')
+    parser.add_argument('--queue-size', type=int, default=1000,
+                        help='Максимум исходящих сообщений в очереди одного клиента (по умолчанию: 1000)')
+    parser.add_argument('--queue-bytes', type=int, default=MAX_QUEUE_BYTES,
+                        help=f'Максимум байт в очереди одного клиента (по умолчанию: {MAX_QUEUE_BYTES})')
+    parser.add_argument('--slow-consumer', choices=SLOW_CONSUMER_POLICIES, default='drop_oldest',
+                        help='Что делать с клиентом, который не успевает читать: '
+                             'выбрасывать старые сообщения или отключать (по умолчанию: drop_oldest)')
+    parser.add_argument('--history-db', default='chat_history.db',
+                        help='Файл базы с историей сообщений (по умолчанию: chat_history.db)')
+    parser.add_argument('--no-history', action='store_true', help='Не сохранять историю сообщений')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Сколько процессов-воркеров запустить на этом порту (по умолчанию: 1)')
+    parser.add_argument('--bus', default=None,
+                        help='Адрес брокера шины (host:port или unix:/путь) для работы в составе нескольких узлов')
+    parser.add_argument('--node-id', type=int, default=None,
+                        help=f'Уникальный номер узла 0-{MAX_NODE_ID} для id сообщений в общей истории')
+    parser.add_argument('--session-key', default='chat_session.key',
+                        help='Файл ключа подписи сессий; создаётся при первом запуске (по умолчанию: chat_session.key)')
+    parser.add_argument('--compress-threshold', type=int, default=COMPRESS_THRESHOLD,
+                        help='Сжимать кадры длиннее стольких байт для клиентов с поддержкой сжатия, '
+                             f'0 - не сжимать (по умолчанию: {COMPRESS_THRESHOLD})')
+    parser.add_argument('--rate-limit', type=float, default=RATE_LIMIT,
+                        help=f'Сообщений в секунду от одного клиента, 0 - без ограничения (по умолчанию: {RATE_LIMIT})')
+    parser.add_argument('--rate-burst', type=int, default=RATE_BURST,
+                        help=f'Сколько сообщений клиент может отправить залпом (по умолчанию: {RATE_BURST})')
+    parser.add_argument('--room-rate-limit', type=float, default=ROOM_RATE_LIMIT,
+                        help=f'Сообщений в секунду в одну комнату, 0 - без ограничения (по умолчанию: {ROOM_RATE_LIMIT})')
+    parser.add_argument('--room-burst', type=int, default=ROOM_BURST,
+                        help=f'Запас комнаты на всплеск сообщений (по умолчанию: {ROOM_BURST})')
+    parser.add_argument('--max-inbound-bytes', type=int, default=MAX_INBOUND_BYTES,
+                        help='Общий предел входящего трафика, байт/с; сверх него сервер '
+                             f'притормаживает чтение, 0 - без предела (по умолчанию: {MAX_INBOUND_BYTES})')
+    parser.add_argument('--max-inflated', type=int, default=MAX_INFLATED,
+                        help='До скольких байт распаковывать сжатый кадр клиента; больше - клиент '
+                             f'отключается (по умолчанию: {MAX_INFLATED})')
+    parser.add_argument('--ping-interval', type=float, default=PING_INTERVAL,
+                        help=f'Через сколько секунд тишины слать клиенту ping (по умолчанию: {PING_INTERVAL})')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help='Через сколько секунд тишины отключать клиента с поддержкой пульса, '
+                             f'0 - никогда (по умолчанию: {IDLE_TIMEOUT})')
+    parser.add_argument('--hello-timeout', type=float, default=HELLO_TIMEOUT,
+                        help=f'Сколько секунд ждать от нового подключения ответа на NICK (по умолчанию: {HELLO_TIMEOUT})')
+    parser.add_argument('--tcp-keepalive', type=int, default=TCP_KEEPALIVE,
+                        help=f'Простой в секундах до TCP keepalive-проб, 0 - выключить (по умолчанию: {TCP_KEEPALIVE})')
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT,
+                        help='Сколько секунд при остановке ждать отправки очередей клиентам '
+                             f'(по умолчанию: {DRAIN_TIMEOUT})')
+    parser.add_argument('--reconnect-spread', type=float, default=RECONNECT_SPREAD,
+                        help='За сколько секунд клиентам предлагается вернуться после остановки '
+                             f'(по умолчанию: {RECONNECT_SPREAD})')
+    parser.add_argument('--tls-cert', default=None,
+                        help='Файл сертификата (PEM) - включает TLS; ключ может лежать в том же файле')
+    parser.add_argument('--tls-key', default=None, help='Файл закрытого ключа (PEM), если он отдельно')
+    parser.add_argument(LISTEN_FD_OPTION, type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--no-sessions', action='store_true',
+                        help='Не выдавать токены сессии (переподключение без сохранения ника)')
+    parser.add_argument('--reuse-port', action='store_true',
+                        help='Открыть порт с SO_REUSEPORT, чтобы его могли слушать несколько процессов')
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='info',
+                        help='Уровень логирования; debug пишет каждое сообщение, off выключает лог (по умолчанию: info)')
+    parser.add_argument('--admin-port', type=int, default=0,
+                        help='Порт HTTP-эндпоинта /metrics на 127.0.0.1, 0 - выключен (по умолчанию: 0)')
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help='Раз в сколько секунд писать статистику в лог, 0 - не писать (по умолчанию: 0)')
     
     args = parser.parse_args()
     
+    if args.workers > 1:
+        run_workers(args)
+        return
+    
     # Проверка порта
-    if args.check_port or not check_port_availability(args.port):
+    if args.listen_fd is None and not args.reuse_port and (args.check_port or not check_port_availability(args.port)):
         if not check_port_availability(args.port):
             print(f"❌ Порт {args.port} занят!")
             print("💡 Попробуйте:")
@@ -239,14 +1935,61 @@ def main():
             print("   netstat -ano | findstr :5555  # Windows - найти процесс")
             return
     
+    tls = None
+    if args.tls_cert:
+        try:
+            tls = make_server_context(args.tls_cert, args.tls_key)
+        except OSError as e:
+            print(f"❌ Не удалось загрузить сертификат TLS: {e}")
+            return
+        print(f"🔒 TLS включён, сертификат: {args.tls_cert}")
+    
     # Запуск сервера
-    server = ChatServer(args.host, args.port)
+    listener = setup_logging(args.log_level)
+    metrics = Metrics()
+    if args.admin_port:
+        start_admin_server(metrics, '127.0.0.1', args.admin_port)
+        print(f"📈 Метрики: http://127.0.0.1:{args.admin_port}/metrics")
+    if args.stats_interval:
+        start_stats_dump(metrics, args.stats_interval)
+    
+    bus = None
+    node_id = args.node_id
+    if args.bus:
+        bus = SocketBus(args.bus)
+        if node_id is None:
+            node_id = os.getpid() % (MAX_NODE_ID + 1)
+            log.warning("⚠️  --node-id не задан, взят %d; на разных узлах он должен отличаться", node_id)
+    
+    history = None if args.no_history else MessageHistory(args.history_db, node_id=node_id)
+    sessions = None if args.no_sessions else SessionTokens(load_session_key(args.session_key))
+    options = dict(queue_size=args.queue_size, queue_bytes=args.queue_bytes,
+                   slow_consumer=args.slow_consumer,
+                   history=history, metrics=metrics, bus=bus, reuse_port=args.reuse_port,
+                   sessions=sessions, compress_threshold=args.compress_threshold,
+                   rate_limit=args.rate_limit, rate_burst=args.rate_burst,
+                   room_rate_limit=args.room_rate_limit, room_burst=args.room_burst,
+                   max_inbound_bytes=args.max_inbound_bytes, max_inflated=args.max_inflated,
+                   ping_interval=args.ping_interval,
+                   idle_timeout=args.idle_timeout, tcp_keepalive=args.tcp_keepalive,
+                   drain_timeout=args.drain_timeout, reconnect_spread=args.reconnect_spread,
+                   listen_fd=args.listen_fd, tls=tls, hello_timeout=args.hello_timeout)
+    if args.backlog is not None:
+        options['backlog'] = args.backlog
+    if args.mode == 'asyncio':
+        server = AsyncChatServer(args.host, args.port, **options)
+    else:
+        server = ChatServer(args.host, args.port, **options)
     
     try:
         server.start_server()
     except KeyboardInterrupt:
-        print("\n🛑 Остановка по команде пользователя")
-        server.stop_server()
+        if not server.stopped:
+            print("\n🛑 Остановка по команде пользователя")
+            server.stop_server()
+    finally:
+        if listener is not None:
+            listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,66 @@
+# Общие помощники тестов: серверы запускаются прямо в процессе теста, в фоновом потоке
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Server import AsyncChatServer, ChatServer  # noqa: E402
+
+# Оба режима сервера: тесты с фикстурой server идут в каждом
+SERVERS = {"threads": ChatServer, "asyncio": AsyncChatServer}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@contextmanager
+def running(server):
+    """Запускает server.start_server в потоке и останавливает его на выходе"""
+    thread = threading.Thread(target=server.start_server, daemon=True)
+    thread.start()
+    ready = (lambda: server.loop is not None) if isinstance(server, AsyncChatServer) else (lambda: server.running)
+    assert wait_until(ready), "сервер не запустился"
+    try:
+        yield server
+    finally:
+        if isinstance(server, AsyncChatServer):
+            server.loop.call_soon_threadsafe(server.request_stop)
+        else:
+            # accept в другом потоке просыпается только от shutdown, а не от close
+            server.running = False
+            server.server_socket.shutdown(socket.SHUT_RDWR)
+        thread.join(10)
+
+
+@pytest.fixture
+def server_options():
+    """Настройки сервера для фикстуры server; модуль тестов переопределяет их своей фикстурой"""
+    return {}
+
+
+@pytest.fixture(params=sorted(SERVERS))
+def server(request, server_options):
+    """Запущенный сервер каждого режима на свободном порту, без ограничений частоты"""
+    options = dict(sessions=None, rate_limit=0, room_rate_limit=0)
+    options.update(server_options)
+    server = SERVERS[request.param]("127.0.0.1", free_port(), **options)
+    with running(server):
+        yield server
@@ -0,0 +1,137 @@
+# Два сервера в одном процессе на Bus.LocalBroker: сообщения ходят между узлами
+# и попадают в историю каждого узла, а вернувшийся с сессией забирает ник у старого
+# подключения на другом узле; узлы на настоящем брокере переживают его потерю
+import asyncio
+import os
+import sqlite3
+
+import pytest
+
+from conftest import free_port, running, wait_until
+from Bus import BusBroker, LocalBroker, SocketBus
+from Headless import HeadlessClient
+from History import MessageHistory
+from Server import ChatServer, SessionTokens
+
+
+def start_nodes(broker, paths):
+    nodes = []
+    for node_id, path in enumerate(paths, 1):
+        history = MessageHistory(str(path), node_id=node_id)
+        nodes.append(ChatServer("127.0.0.1", free_port(), history=history, bus=broker.attach(),
+                                sessions=None, rate_limit=0, room_rate_limit=0))
+    return nodes
+
+
+async def received_from(client, sender):
+    """Ждёт сообщение комнаты от sender"""
+    while True:
+        message = await asyncio.wait_for(client.messages.get(), 5)
+        if message.get("sender") == sender and message.get("type", "message") == "message":
+            return message
+
+
+async def exchange(first, second):
+    """alice на первом узле пишет в #general, bob на втором его получает"""
+    alice = HeadlessClient("alice", "127.0.0.1", first.port)
+    bob = HeadlessClient("bob", "127.0.0.1", second.port)
+    await alice.connect()
+    await bob.connect()
+    await alice.send_message("привет с другого узла")
+    try:
+        return await received_from(bob, "alice")
+    finally:
+        await alice.close()
+        await bob.close()
+
+
+def stored(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT id, room, sender, message FROM messages").fetchall()
+
+
+@pytest.mark.parametrize("shared", [False, True], ids=["own-db", "shared-db"])
+def test_message_crosses_nodes_and_is_stored_once(tmp_path, shared):
+    broker = LocalBroker()
+    paths = [tmp_path / "chat.db"] * 2 if shared else [tmp_path / "a.db", tmp_path / "b.db"]
+    first, second = start_nodes(broker, paths)
+    with running(first), running(second):
+        message = asyncio.run(exchange(first, second))
+        # Второй узел отдаёт чужое сообщение из своей истории под тем же id
+        assert wait_until(lambda: any(item["id"] == message["id"]
+                                      for item in second.history.fetch("general")[0]))
+
+    expected = (message["id"], "general", "alice", "привет с другого узла")
+    for path in set(paths):
+        assert stored(str(path)) == [expected]
+
+
+async def reconnect_elsewhere(first, second):
+    """alice входит на первый узел, а после обрыва, пока старый сокет ещё открыт, - на второй"""
+    stale = HeadlessClient("alice", "127.0.0.1", first.port)
+    await stale.connect()
+    fresh = HeadlessClient("alice", "127.0.0.1", second.port, session=stale.session)
+    welcome = await fresh.connect()
+    try:
+        assert welcome["nickname"] == "alice" and welcome["resumed"]
+        assert wait_until(lambda: first.clients.get("alice") is None)
+        await asyncio.wait_for(stale.receive_task, 5)
+        # Для всех alice так и осталась в сети
+        assert "alice" in first.roster and "alice" in second.roster
+    finally:
+        await stale.close()
+        await fresh.close()
+
+
+@pytest.mark.parametrize("kind", ["local", "socket"])
+def test_session_resume_takes_nickname_over_from_another_node(tmp_path, kind):
+    if kind == "local":
+        broker = LocalBroker()
+        attach = broker.attach
+    else:
+        address = f"unix:{tmp_path / 'bus.sock'}"
+        broker = BusBroker(address)
+        broker.start()
+        attach = lambda: SocketBus(address)
+    sessions = SessionTokens(os.urandom(32))
+    first, second = (ChatServer("127.0.0.1", free_port(), bus=attach(), sessions=sessions,
+                                rate_limit=0, room_rate_limit=0) for _ in range(2))
+    try:
+        with running(first), running(second):
+            asyncio.run(reconnect_elsewhere(first, second))
+    finally:
+        if kind == "socket":
+            broker.stop()
+
+
+async def without_broker(node):
+    """Брокера нет: отправитель не отваливается, выход освобождает подключение, вход работает"""
+    alice = HeadlessClient("alice", "127.0.0.1", node.port)
+    await alice.connect()
+    await alice.send_message("брокера нет")
+    assert (await received_from(alice, "alice"))["message"] == "брокера нет"
+    carol = HeadlessClient("carol", "127.0.0.1", node.port)
+    await carol.connect()
+    await carol.close()
+    assert wait_until(lambda: len(node.clients) == 1)
+    await alice.close()
+
+
+def test_nodes_survive_broker_restart(tmp_path):
+    address = f"unix:{tmp_path / 'bus.sock'}"
+    broker = BusBroker(address)
+    broker.start()
+    first, second = (ChatServer("127.0.0.1", free_port(), bus=SocketBus(address),
+                                sessions=None, rate_limit=0, room_rate_limit=0) for _ in range(2))
+    try:
+        with running(first), running(second):
+            broker.stop()
+            assert wait_until(lambda: not first.bus.connected)
+            asyncio.run(without_broker(first))
+
+            broker = BusBroker(address)
+            broker.start()
+            assert wait_until(lambda: first.bus.connected and second.bus.connected, timeout=15)
+            assert asyncio.run(exchange(first, second))["message"] == "привет с другого узла"
+    finally:
+        broker.stop()
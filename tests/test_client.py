@@ -0,0 +1,24 @@
+# Консольный клиент: строки после /join и /leave уходят уже в новую комнату
+import io
+
+import conftest  # noqa: F401  (путь к модулям репозитория)
+from conftest import free_port, running, wait_until
+from Client import ConsoleClient
+from History import MessageHistory
+from Server import ChatServer
+
+
+def test_input_after_room_change_goes_to_new_room(tmp_path):
+    server = ChatServer("127.0.0.1", free_port(), history=MessageHistory(str(tmp_path / "chat.db")),
+                        sessions=None, rate_limit=0, room_rate_limit=0)
+    script = "/join dev\nhi dev\n/leave\nhi general\n/join #\nstill general\n/join ops\nhi ops\n"
+    with running(server):
+        client = ConsoleClient(output=io.StringIO())
+        client.session_file = None
+        client.connect("127.0.0.1", server.port, "zed")
+        client.run(io.StringIO(script))
+        sent = lambda room: [item["message"] for item in server.history.fetch(room)[0] if item["sender"] == "zed"]
+        assert wait_until(lambda: sent("ops"))
+        assert sent("general") == ["hi general", "still general"]
+        assert sent("dev") == ["hi dev"]
+        assert sent("ops") == ["hi ops"]
@@ -0,0 +1,21 @@
+# Подключение, которое так и не ответило на NICK, сервер закрывает через hello_timeout
+import socket
+
+import pytest
+
+from conftest import wait_until
+from Protocol import NICK_REQUEST, FrameReader
+
+
+@pytest.fixture
+def server_options():
+    return {"hello_timeout": 0.3}
+
+
+def test_silent_connection_is_closed(server):
+    with socket.create_connection(("127.0.0.1", server.port), timeout=5) as sock:
+        reader = FrameReader(sock)
+        assert reader.read_frame() == NICK_REQUEST
+        # Молчим: сервер должен закрыть подключение сам, а не ждать вечно
+        assert reader.read_frame() is None
+    assert wait_until(lambda: server.metrics.snapshot()["counters"].get("hello_timeouts") == 1)
@@ -0,0 +1,61 @@
+# Поиск по истории: комнаты в индексе FTS5 и переход со старой схемы индекса
+import sqlite3
+
+import pytest
+
+import conftest  # noqa: F401  (путь к модулям репозитория)
+from History import MessageHistory
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = MessageHistory(str(tmp_path / "chat.db"))
+    if not history.searchable:
+        pytest.skip("SQLite без FTS5")
+    yield history
+    history.close()
+
+
+def fill(history, rows):
+    ids = [history.append(room, sender, message, "12:00:00") for room, sender, message in rows]
+    history.flush()
+    return ids
+
+
+def test_search_is_limited_to_rooms(history):
+    general, dev, devops, _ = fill(history, [
+        ("general", "alice", "отчёт готов"),
+        ("dev", "bob", "отчёт по серверу"),
+        ("dev-ops", "carol", "отчёт по деплою"),
+        ("secret", "dave", "отчёт секретный"),
+    ])
+    found = lambda rooms: [item["id"] for item in history.search("отчёт", rooms)[0]]
+    assert found({"general", "dev"}) == [dev, general]
+    # "dev" в индексе совпадает с началом "dev-ops", но комнату проверяет SQL
+    assert found({"dev"}) == [dev]
+    assert found({"dev-ops"}) == [devops]
+    assert found({"empty"}) == []
+    assert [item["id"] for item in history.search("from:bob отчёт", {"general", "dev"})[0]] == [dev]
+
+
+def test_old_index_without_room_is_rebuilt(tmp_path):
+    path = str(tmp_path / "old.db")
+    with sqlite3.connect(path) as connection:
+        connection.executescript("""
+            CREATE TABLE messages (id INTEGER PRIMARY KEY, room TEXT NOT NULL, sender TEXT NOT NULL,
+                                   message TEXT NOT NULL, timestamp TEXT NOT NULL, created REAL NOT NULL);
+            CREATE VIRTUAL TABLE messages_fts USING fts5(message, sender, content='messages',
+                                                         content_rowid='id');
+            CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, message, sender) VALUES (new.id, new.message, new.sender);
+            END;
+            INSERT INTO messages VALUES (1, 'dev', 'bob', 'старый отчёт', '11:00:00', 0);
+        """)
+    history = MessageHistory(path)
+    try:
+        if not history.searchable:
+            pytest.skip("SQLite без FTS5")
+        new_id = fill(history, [("dev", "alice", "новый отчёт")])[0]
+        assert [item["id"] for item in history.search("отчёт", {"dev"})[0]] == [new_id, 1]
+    finally:
+        history.close()
@@ -0,0 +1,61 @@
+# Сжатые кадры клиента: предел трафика считает их распакованный размер,
+# а распаковка ограничена max_inflated
+import asyncio
+
+import pytest
+
+from conftest import wait_until
+from Headless import HeadlessClient
+
+
+@pytest.fixture
+def server_options():
+    return {"max_inbound_bytes": 50000, "max_inflated": 100000}
+
+
+def counters(server):
+    return server.metrics.snapshot()["counters"]
+
+
+def paused(server):
+    return server.metrics.snapshot()["histograms"].get("inbound_paused_seconds", {}).get("count", 0)
+
+
+async def send_compressed(server, content):
+    """Отправляет сообщение сжатым кадром; возвращает клиента и размер кадра в сети"""
+    client = HeadlessClient("zip", "127.0.0.1", server.port, compression="deflate")
+    await client.connect()
+    frame = client.codec.encode({"type": "message", "content": content, "room": "general"})
+    client.writer.write(frame)
+    await client.writer.drain()
+    return client, len(frame)
+
+
+async def charged_scenario(server):
+    client, wire_size = await send_compressed(server, "0" * 60000)
+    try:
+        assert wire_size < 1000
+        # 60 КБ после распаковки больше запаса в 50 КБ: чтение приостанавливается
+        assert wait_until(lambda: paused(server) == 1)
+        assert counters(server)["bytes_in_inflated"] >= 60000
+    finally:
+        await client.close()
+
+
+def test_inbound_limit_counts_inflated_size(server):
+    asyncio.run(charged_scenario(server))
+
+
+async def bomb_scenario(server):
+    client, wire_size = await send_compressed(server, "0" * 10 ** 6)
+    try:
+        assert wire_size < 5000
+        await asyncio.wait_for(client.receive_task, 5)
+        assert counters(server).get("disconnects.protocol") == 1
+        assert "messages_in" not in counters(server)
+    finally:
+        await client.close()
+
+
+def test_oversized_inflation_disconnects(server):
+    asyncio.run(bomb_scenario(server))
@@ -0,0 +1,113 @@
+# Ящик личных сообщений: почту получает только вход с токеном сессии владельца ника,
+# а число ждущих сообщений ограничено
+import asyncio
+import os
+
+import pytest
+
+import History
+from Headless import HeadlessClient
+from History import MessageHistory
+from Server import SessionTokens
+
+
+@pytest.fixture
+def server_options(tmp_path):
+    return {"history": MessageHistory(str(tmp_path / "chat.db")), "sessions": SessionTokens(os.urandom(32))}
+
+
+async def login(server, nickname, session=None):
+    client = HeadlessClient(nickname, "127.0.0.1", server.port, session=session)
+    await client.connect()
+    return client
+
+
+async def frames_of(client, msg_type, wait=0.5):
+    """Собирает кадры нужного типа, пришедшие за wait секунд"""
+    found = []
+    deadline = asyncio.get_running_loop().time() + wait
+    while True:
+        timeout = deadline - asyncio.get_running_loop().time()
+        if timeout <= 0:
+            return found
+        try:
+            message = await asyncio.wait_for(client.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return found
+        if message.get("type") == msg_type:
+            found.append(message)
+
+
+async def mailbox_scenario(server):
+    alice = await login(server, "alice")
+    token = alice.session
+    await alice.close()
+
+    bob = await login(server, "bob")
+    await bob.send({"type": "private", "recipient": "alice", "content": "только для alice"})
+    [echo] = await frames_of(bob, "private")
+    assert echo["offline"]
+    # Ник, который никто не занимал, ящика не имеет
+    await bob.send({"type": "private", "recipient": "nobody", "content": "кому-нибудь"})
+    [refused] = await frames_of(bob, "error")
+    assert refused["code"] == "no_mailbox"
+
+    # Свободный ник без токена - вход разрешён, но ни почты, ни токена на этот ник
+    impostor = await login(server, "alice")
+    assert impostor.nickname == "alice"
+    assert impostor.session is None
+    assert await frames_of(impostor, "offline") == []
+    await impostor.close()
+    # и с тем, что ему выдали, чужую почту тоже не забрать
+    impostor = await login(server, "alice", session=impostor.session)
+    assert await frames_of(impostor, "offline") == []
+    await impostor.close()
+
+    owner = await login(server, "alice", session=token)
+    assert owner.session is not None
+    [offline] = await frames_of(owner, "offline")
+    assert [item["message"] for item in offline["messages"]] == ["только для alice"]
+    await owner.close()
+    await bob.close()
+
+
+def test_mailbox_needs_session_token(server):
+    asyncio.run(mailbox_scenario(server))
+
+
+def test_mailbox_limits(tmp_path, monkeypatch):
+    monkeypatch.setattr(History, "OFFLINE_LIMIT", 2)
+    monkeypatch.setattr(History, "OFFLINE_SENDER_LIMIT", 3)
+    monkeypatch.setattr(History, "OFFLINE_TOTAL_LIMIT", 4)
+    history = MessageHistory(str(tmp_path / "chat.db"))
+    try:
+        queue = lambda recipient, sender, origin: history.queue_private(recipient, sender, "текст",
+                                                                        "12:00:00", origin)
+        assert queue("alice", "bob", "10.0.0.1") is None
+        assert queue("alice", "bob", "10.0.0.1") is None
+        assert queue("alice", "carol", "10.0.0.2") == "mailbox_full"
+        assert queue("dave", "bob", "10.0.0.1") is None
+        # С адреса bob ушло уже три сообщения - новый ник лимит не обнуляет
+        assert queue("erin", "bob_2", "10.0.0.1") == "sender_limit"
+        assert queue("erin", "carol", "10.0.0.2") is None
+        assert queue("frank", "carol", "10.0.0.2") == "storage_full"
+    finally:
+        history.close()
+
+
+def test_nickname_is_bound_to_first_owner(tmp_path):
+    history = MessageHistory(str(tmp_path / "chat.db"))
+    try:
+        owner = history.bind_nickname("alice", None, ttl=60)
+        assert owner is not None and history.is_bound("alice")
+        assert history.bind_nickname("alice", None, ttl=60) is None
+        assert history.bind_nickname("alice", "0" * 16, ttl=60) is None
+        assert history.bind_nickname("alice", owner, ttl=60) == owner
+        history.queue_private("alice", "bob", "старое", "12:00:00", "10.0.0.1")
+        # Владелец не заходил дольше ttl: ник свободен, а его почта новому не достаётся
+        history.bind_nickname("alice", owner, ttl=-1)
+        assert not history.is_bound("alice")
+        assert history.bind_nickname("alice", None, ttl=60) not in (None, owner)
+        assert history.take_private("alice") == []
+    finally:
+        history.close()
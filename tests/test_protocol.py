@@ -0,0 +1,64 @@
+# Компактная кодировка: что не влезает в заголовок, должно уходить JSON, а не падать;
+# распаковка сжатых кадров ограничена
+import zlib
+
+import pytest
+
+import conftest  # noqa: F401  (путь к модулям репозитория)
+from Protocol import (COMPRESSION_DICTIONARY, HEADER_SIZE, JSON_START, TAG_DEFLATE, TAG_MESSAGE, TAG_SEND,
+                      CompactCodec, ProtocolError, get_codec)
+
+CHAT = {"type": "message", "sender": "alice", "message": "привет", "timestamp": "12:00:00",
+        "room": "general", "id": 42}
+
+
+def roundtrip(message_data):
+    codec = CompactCodec()
+    payload = codec.encode(message_data)[HEADER_SIZE:]
+    assert codec.decode(payload) == message_data
+    return payload[0]
+
+
+def test_chat_and_send_are_packed():
+    assert roundtrip(CHAT) == TAG_MESSAGE
+    assert roundtrip(dict(CHAT, sender="SERVER")) == TAG_MESSAGE
+    assert roundtrip({"type": "message", "content": "hi", "room": "dev"}) == TAG_SEND
+
+
+@pytest.mark.parametrize("fields", [
+    {"sender": "N" * 70000},
+    {"timestamp": "t" * 300},
+    {"room": "r" * 300},
+    {"message": 12345},
+    {"sender": None},
+    {"id": -1},
+    {"id": 1 << 64},
+], ids=["long-sender", "long-timestamp", "long-room", "int-message", "no-sender", "negative-id", "huge-id"])
+def test_unpackable_chat_falls_back_to_json(fields):
+    assert roundtrip(dict(CHAT, **fields)) == JSON_START
+
+
+@pytest.mark.parametrize("fields", [{"content": 5}, {"room": "r" * 300}, {"room": ["dev"]}],
+                         ids=["int-content", "long-room", "list-room"])
+def test_unpackable_send_falls_back_to_json(fields):
+    assert roundtrip(dict({"type": "message", "content": "hi", "room": "dev"}, **fields)) == JSON_START
+
+
+def test_inflation_is_limited():
+    codec = get_codec("json", "deflate", threshold=16)
+    payload = codec.encode({"type": "message", "content": "0" * 100000})[HEADER_SIZE:]
+    assert len(payload) < 1000
+    assert len(codec.unpack(payload)) > 100000
+    with pytest.raises(ProtocolError):
+        codec.unpack(payload, max_size=50000)
+
+
+def test_inflated_payload_is_not_inflated_again():
+    codec = get_codec("json", "deflate", threshold=16)
+    inner = codec.encode({"type": "message", "content": "0" * 10000000})[HEADER_SIZE:]
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=COMPRESSION_DICTIONARY)
+    nested = bytes((TAG_DEFLATE,)) + compressor.compress(inner) + compressor.flush()
+    # Сжатое внутри сжатого распаковывается один раз и дальше - просто не JSON
+    assert codec.unpack(nested) == inner
+    with pytest.raises(ValueError):
+        codec.decode_unpacked(codec.unpack(nested))
@@ -0,0 +1,52 @@
+# Исходящая очередь клиента ограничена не только числом кадров, но и байтами
+import socket
+
+import conftest  # noqa: F401  (путь к модулям репозитория)
+from Protocol import FrameReader, encode_frame
+from Server import ClientConnection, WRITE_BATCH_BYTES
+
+
+def test_queue_is_bounded_by_bytes():
+    left, right = socket.socketpair()
+    with left, right:
+        connection = ClientConnection(left, ("local", 0), max_queue=1000, max_queue_bytes=10000)
+        # Писатель не запущен: клиент "не читает", всё копится в очереди
+        for _ in range(10):
+            assert connection.send(b"x" * 3000)
+        assert len(connection.queue) == 3
+        assert connection.queued_bytes == 9000
+        assert connection.dropped == 7
+        # Одиночный кадр больше предела всё равно уходит, вытеснив остальные
+        assert connection.send(b"y" * 20000)
+        assert list(connection.queue) == [b"y" * 20000]
+        assert connection.queued_bytes == 20000
+
+
+def test_slow_consumer_disconnected_by_bytes():
+    left, right = socket.socketpair()
+    with left, right:
+        connection = ClientConnection(left, ("local", 0), max_queue=1000, policy='disconnect',
+                                      max_queue_bytes=10000)
+        assert connection.send(b"x" * 6000)
+        assert not connection.send(b"x" * 6000)
+        assert connection.close_reason == 'slow_consumer'
+        assert connection.queued_bytes == 0
+
+
+def test_writer_sends_in_batches():
+    left, right = socket.socketpair()
+    with left, right:
+        connection = ClientConnection(left, ("local", 0))
+        frame = encode_frame(b"x" * 1000)
+        count = 3 * WRITE_BATCH_BYTES // len(frame)
+        for _ in range(count):
+            connection.send(frame)
+        connection.start()
+        right.settimeout(5)
+        reader = FrameReader(right)
+        for _ in range(count):
+            assert reader.read_frame() == b"x" * 1000
+        connection.close()
+        connection.writer_thread.join(5)
+        assert connection.queued_bytes == 0
+        assert connection.metrics.snapshot()["counters"]["frames_out"] == count
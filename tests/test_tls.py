@@ -0,0 +1,75 @@
+# TLS с самоподписанным сертификатом, созданным на время тестов, в обоих режимах сервера:
+# зависшее рукопожатие не держит приём остальных, а переподключение возобновляет сессию
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+
+from conftest import wait_until
+from Protocol import NICK_REQUEST, FrameReader, decode_message, encode_hello, make_client_context
+from Server import make_server_context
+
+
+@pytest.fixture(scope="module")
+def certificate(tmp_path_factory):
+    if shutil.which("openssl") is None:
+        pytest.skip("нужен openssl для самоподписанного сертификата")
+    directory = tmp_path_factory.mktemp("tls")
+    cert, key = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                    "-nodes", "-keyout", str(key), "-out", str(cert), "-days", "1", "-subj", "/CN=localhost",
+                    "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1"],
+                   check=True, capture_output=True)
+    return str(cert), str(key)
+
+
+@pytest.fixture
+def server_options(certificate):
+    return {"tls": make_server_context(*certificate)}
+
+
+def login(server, context, nickname, session=None):
+    """Подключение по TLS до приветствия; возвращает сокет и приветствие"""
+    sock = context.wrap_socket(socket.create_connection(("127.0.0.1", server.port), timeout=5),
+                               server_hostname="localhost", session=session)
+    reader = FrameReader(sock)
+    assert reader.read_frame() == NICK_REQUEST
+    sock.sendall(encode_hello(nickname))
+    return sock, decode_message(reader.read_frame())
+
+
+def counter(server, name):
+    return server.metrics.snapshot()["counters"].get(name, 0)
+
+
+def test_stalled_handshake_does_not_block_accept(server, certificate):
+    # Подключения, которые так и не начали рукопожатие
+    stalled = [socket.create_connection(("127.0.0.1", server.port)) for _ in range(3)]
+    try:
+        started = time.monotonic()
+        sock, welcome = login(server, make_client_context(certificate[0]), "alice")
+        sock.close()
+        assert welcome["type"] == "welcome"
+        assert time.monotonic() - started < 2
+    finally:
+        for sock in stalled:
+            sock.close()
+
+
+def test_reconnect_resumes_tls_session(server, certificate):
+    context = make_client_context(certificate[0])
+    sock, welcome = login(server, context, "bob")
+    # Билет TLS 1.3 приходит после рукопожатия - к приветствию он уже есть
+    session = sock.session
+    sock.close()
+    assert not welcome["resumed"]
+
+    sock, welcome = login(server, context, "bob", session=session)
+    try:
+        assert sock.session_reused
+    finally:
+        sock.close()
+    assert wait_until(lambda: counter(server, "tls_handshakes") == 2)
+    assert counter(server, "tls_resumed") == 1